@@ -4,8 +4,6 @@ from PySheets import from_csv, StrippedCsv, PyTable, HeadlessData
 from sqlite_utilities import FinanceDbSession
 import sqlite3
 
-from main import check_lookup
-
 
 def get_name() -> str:
     name_ind = input('Available profiles:\n'
@@ -90,6 +88,8 @@ def main():
     }
     # make a blank table with static headers
     all_table = StrippedCsv()
+    # main and its big parser lookup tables are only loaded once there are files to parse, not before the prompts
+    from main import check_lookup
     # load all into an "all_raw_table", headers [date, amount, memo, account, person]
     for filename, data in raw_data.items():
         parsing_func = check_lookup(filename, filename_lookup,
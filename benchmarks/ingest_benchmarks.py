@@ -0,0 +1,212 @@
+"""Benchmarks for the statement pipeline, run against synthetic statements from synthetic_statements.py.
+
+    python benchmarks/ingest_benchmarks.py --rows 10000
+    python benchmarks/ingest_benchmarks.py --rows 1000000 --only make_table classify
+    python benchmarks/ingest_benchmarks.py --update-baselines
+
+Each benchmark is timed --repeat times and the best time is kept. Results are compared with the baselines stored in
+--baselines (benchmarks/baselines.json unless $BENCHMARK_BASELINES names another file), which are kept per machine
+(hostname and python version) and per row count, since timings from different machines don't compare. The file is
+local to the machine and ignored by git. A benchmark more than --tolerance slower than its baseline is
+flagged as a regression and the script exits with status 1. A benchmark with no baseline yet has its time recorded
+as the baseline. --update-baselines records every result.
+
+Everything runs in a throwaway session folder with the four accounts of sessions/test set up, and the snippets
+table seeded with the generator's snippets.
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY)
+
+import main  # noqa: E402
+import my_program  # noqa: E402
+from PySheets import PyTable, from_csv  # noqa: E402
+from snippet_utilities import SnippetMatcher  # noqa: E402
+from sqlite_utilities import connection_manager, query_stats  # noqa: E402
+from synthetic_statements import FORMATS, MemoPool, write_statement_set  # noqa: E402
+
+BASELINES_FILE = os.environ.get('BENCHMARK_BASELINES') or os.path.join(REPOSITORY, 'benchmarks', 'baselines.json')
+
+# (account_id, date_column, memo_column, amount_column, parsing_protocol, flip_amount, filename snippet)
+ACCOUNTS = {
+    'apple': ('Apple Card', 'Transaction Date', 'Description', 'Amount (USD)', 1, 1, 'Apple Card Transactions'),
+    'chase': ('Chase Card', 'Transaction Date', 'Description', 'Amount', 1, 0, 'Chase4452_Activity'),
+    'wf': ('Wells Fargo', '0', '4', '1', 2, 0, 'WF_'),
+    'amz': ('Amazon', 'Transaction Date', 'Description', 'Amount', 1, 0, 'AMZ_'),
+}
+
+
+def machine_key() -> str:
+    return f'{platform.node()} / python {platform.python_version()}'
+
+
+def load_baselines(filepath) -> dict:
+    if not os.path.isfile(filepath):
+        return {}
+    with open(filepath) as file:
+        return json.load(file)
+
+
+def save_baselines(baselines: dict, filepath):
+    with open(filepath, 'w') as file:
+        json.dump(baselines, file, indent=2, sort_keys=True)
+        file.write('\n')
+
+
+def best_time(function, repeat: int) -> float:
+    """the fastest of repeat calls, with the program's printing thrown away"""
+    times = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(repeat):
+            with contextlib.redirect_stdout(devnull):
+                start = time.perf_counter()
+                function()
+                times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def set_up_session(directory, pool: MemoPool) -> dict:
+    """a fresh session in directory (which becomes the working directory) with the benchmark accounts and the
+    pool's snippets on every account
+
+    :return: {format: account_key}
+    """
+    os.makedirs(directory)
+    os.chdir(directory)
+    os.mkdir('raw_data')
+    os.mkdir('processed_data')
+    account_keys = {}
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        my_program.initialize_db()
+        vendor_key = my_program.add_vendor_to_db('synthetic vendor', typical_type_key=1)
+        type_key = my_program.get_type_key_from_id('Transfer')
+        for statement_format, (account_id, date_column, memo_column, amount_column, parsing_protocol, flip_amount,
+                               filename_snippet) in ACCOUNTS.items():
+            account_key = my_program.add_account_to_db(account_id, date_column, memo_column, amount_column,
+                                                       parsing_protocol, None, flip_amount)
+            my_program.add_snippet_to_db(filename_snippet, account_key)
+            for snippet in pool.snippets:
+                my_program.add_snippet_to_db(snippet, account_key, vendor_key, type_key)
+            account_keys[statement_format] = account_key
+    return account_keys
+
+
+def run_benchmarks(rows: int, memos: int, hit_rate: float, repeat: int, only=None, seed: int = 0) -> dict:
+    """:return: {benchmark name: best seconds}"""
+    results = {}
+    wanted = set(only or [])
+
+    def bench(name, function):
+        if wanted and not any(name.startswith(prefix) for prefix in wanted):
+            return
+        results[name] = best_time(function, repeat)
+        print(f'\t{name:<32} {results[name]:.4f}s', flush=True)
+
+    working_directory = os.getcwd()
+    scratch = tempfile.mkdtemp(prefix='ingest_benchmarks_')
+    try:
+        pool = MemoPool(memos, hit_rate, seed)
+        paths = write_statement_set(os.path.join(scratch, 'statements'), rows, pool, seed=seed)
+        account_keys = set_up_session(os.path.join(scratch, 'session'), pool)
+        print(f'{rows} rows per statement, {memos} distinct memos, {len(pool.snippets)} snippets, '
+              f'{hit_rate:.0%} snippet hit rate')
+
+        for statement_format in FORMATS:
+            account_key = account_keys[statement_format]
+            account_data = my_program.get_account_data(account_key)
+            path = paths[statement_format]
+            bench(f'make_table[{statement_format}]', lambda: my_program.make_table(account_data, path))
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                table = my_program.make_table(account_data, path)
+            matcher = SnippetMatcher(my_program.get_account_snippet_pairs(account_key))
+            bench(f'classify[{statement_format}]',
+                  lambda: my_program.prepare_transaction_table(table.copy(), account_key, matcher))
+            # the same filename every time, so every repeat purges and reloads the same rows
+            bench(f'ingest[{statement_format}]', lambda: my_program.import_raw_file(path, force=True))
+
+        sheet = from_csv(paths['chase'])
+        pivot_table = PyTable(sheet[0], sheet[1:])
+        bench('PyTable.pivot', lambda: pivot_table.pivot('Category', 'Amount'))
+
+        # main.py looks for the statements of a person in a folder called f'{data_filepath}\{person}' and picks the
+        # parser from the filename. that's a real folder name with a backslash in it off windows.
+        person_directory = os.path.join(scratch, 'data') + '\\' + 'bench'
+        os.makedirs(person_directory)
+        for statement_format, filename in (('chase', 'Chase_synthetic.csv'), ('wf', 'WF_Checking_synthetic.csv'),
+                                           ('apple', 'Apple_synthetic.csv')):
+            shutil.copyfile(paths[statement_format], os.path.join(person_directory, filename))
+        bench('main.get_all_transactions', lambda: main.get_all_transactions(os.path.join(scratch, 'data'), 'bench'))
+    finally:
+        connection_manager.close_all()
+        os.chdir(working_directory)
+        shutil.rmtree(scratch, ignore_errors=True)
+    return results
+
+
+def compare(results: dict, rows: int | None, tolerance: float, update: bool, baselines_file=BASELINES_FILE) -> int:
+    """prints results next to the baselines stored in baselines_file and records new ones. rows tells runs of
+    different sizes apart, None for benchmarks that don't have a size.
+
+    :return: the number of regressions
+    """
+    baselines = load_baselines(baselines_file)
+    machine = baselines.setdefault(machine_key(), {})
+    regressions = 0
+    print(f'\n{"benchmark":<32} {"baseline":>10} {"current":>10} {"change":>8}')
+    for name, seconds in results.items():
+        key = name if rows is None else f'{name}@{rows}'
+        baseline = machine.get(key)
+        if baseline is None:
+            flag, change = 'new baseline', ''
+            machine[key] = seconds
+        else:
+            ratio = seconds / baseline - 1
+            change = f'{ratio:+.0%}'
+            if ratio > tolerance:
+                flag = 'REGRESSION'
+                regressions += 1
+            elif ratio < -tolerance:
+                flag = 'faster'
+            else:
+                flag = ''
+            if update:
+                machine[key] = seconds
+        baseline_text = '' if baseline is None else f'{baseline:.4f}s'
+        print(f'{name:<32} {baseline_text:>10} {seconds:>9.4f}s {change:>8}  {flag}')
+    save_baselines(baselines, baselines_file)
+    return regressions
+
+
+def main_benchmarks():
+    parser = argparse.ArgumentParser(description='times the statement pipeline against synthetic statements')
+    parser.add_argument('--rows', type=int, default=10000, help='transactions per statement')
+    parser.add_argument('--memos', type=int, default=500, help='distinct memos')
+    parser.add_argument('--hit-rate', type=float, default=0.8, help='share of rows that contain a snippet')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark, the best one counts')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='slowdown past which a result is flagged')
+    parser.add_argument('--only', nargs='+', help='run only the benchmarks starting with these names')
+    parser.add_argument('--update-baselines', action='store_true', help='store these results as the baselines')
+    parser.add_argument('--baselines', default=BASELINES_FILE, help='the file the baselines are kept in')
+    args = parser.parse_args()
+    # the program's debug logging and slow query warnings would be timed along with everything else
+    logging.disable(logging.WARNING)
+    query_stats.slow_query_seconds = None
+    results = run_benchmarks(args.rows, args.memos, args.hit_rate, args.repeat, args.only)
+    regressions = compare(results, args.rows, args.tolerance, args.update_baselines, args.baselines)
+    if regressions:
+        print(f'\n{regressions} regressions')
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main_benchmarks()
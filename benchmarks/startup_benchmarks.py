@@ -0,0 +1,112 @@
+"""Startup time of the interactive program, and a guard that the menus come up without loading the heavy libraries.
+
+    python benchmarks/startup_benchmarks.py
+    python benchmarks/startup_benchmarks.py --repeat 10 --update-baselines
+
+Each run is a fresh interpreter, since the cost being measured is the imports. The child imports my_program, picks
+the first session in the start menu and exits from the main menu, then reports:
+
+    import my_program - seconds to import the module
+    menus             - seconds from main() starting to the main menu's exit
+    process           - wall time of the whole child, interpreter start-up included
+
+The best of --repeat runs is compared with the baselines file the same way ingest_benchmarks.py does it. If
+pandas or numpy was imported by the time the main menu exits, the script reports which one and exits with status 1
+whatever the timings are, because that's the regression this is here to catch.
+"""
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY)
+
+from ingest_benchmarks import BASELINES_FILE, compare  # noqa: E402
+
+HEAVY_MODULES = ('pandas', 'numpy')
+
+# runs in the child, with the repository as argv[1]. the report is the last line of its output.
+CHILD = """
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+start = time.perf_counter()
+import my_program
+imported = time.perf_counter()
+my_program.main()
+finished = time.perf_counter()
+print(json.dumps({
+    'import my_program': imported - start,
+    'menus': finished - imported,
+    'loaded': [name for name in %r if name in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+# start menu: the first (only) session. main menu: 0, exit.
+MENU_INPUT = '1\n0\n'
+
+
+def set_up_sessions(directory):
+    """a sessions folder in directory with one empty session in it"""
+    import my_program
+    session = os.path.join(directory, 'sessions', 'startup')
+    os.makedirs(session)
+    working_directory = os.getcwd()
+    os.chdir(session)
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            my_program.initialize_db()
+            my_program.migrate_database(my_program.database)
+    finally:
+        my_program.connection_manager.close_all()
+        os.chdir(working_directory)
+
+
+def run_once(directory) -> dict:
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-c', CHILD, REPOSITORY], cwd=directory, input=MENU_INPUT,
+                               capture_output=True, text=True)
+    seconds = time.perf_counter() - start
+    if completed.returncode:
+        raise RuntimeError(f'the program exited with status {completed.returncode}:\n{completed.stderr}')
+    report = json.loads(completed.stdout.strip().splitlines()[-1])
+    report['process'] = seconds
+    return report
+
+
+def main_benchmarks():
+    parser = argparse.ArgumentParser(description='times the interactive program getting to its menus')
+    parser.add_argument('--repeat', type=int, default=5, help='runs, the best one counts')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='slowdown past which a result is flagged')
+    parser.add_argument('--update-baselines', action='store_true', help='store these results as the baselines')
+    parser.add_argument('--baselines', default=BASELINES_FILE, help='the file the baselines are kept in')
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='startup_benchmarks_')
+    try:
+        set_up_sessions(scratch)
+        reports = [run_once(scratch) for _ in range(args.repeat)]
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    results = {f'startup.{measure}': min(report[measure] for report in reports)
+               for measure in ('import my_program', 'menus', 'process')}
+    for name, seconds in results.items():
+        print(f'\t{name:<32} {seconds:.4f}s')
+    regressions = compare(results, None, args.tolerance, args.update_baselines, args.baselines)
+    loaded = sorted({name for report in reports for name in report['loaded']})
+    if loaded:
+        print(f'\n{", ".join(loaded)} imported before the menus were done')
+        regressions += 1
+    if regressions:
+        print(f'\n{regressions} regressions')
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main_benchmarks()
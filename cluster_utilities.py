@@ -0,0 +1,113 @@
+"""Groups unmatched transactions whose memos differ only in their numbers, so that match_unmatched_transactions can ask
+about a whole group at once instead of one near-identical memo at a time.
+
+A memo's cluster key is its first few words, upper cased. Words with a digit in them (store numbers, dates,
+reference numbers) are skipped, and so is the punctuation around words. So are the words banks put in front of
+every card purchase (BOILERPLATE_WORDS) while they come before anything else, or all of a bank's purchases would
+share a key:
+
+    'TESLA INC SUPERCHARGER 1234 FREMONT CA'                   -> 'TESLA INC SUPERCHARGER'
+    'Tesla Inc Supercharger #88 Gilroy'                        -> 'TESLA INC SUPERCHARGER'
+    'AMAZON MKTPL*2K4LX9 AMZN.COM/BILL WA'                     -> 'AMAZON AMZN.COM/BILL WA'
+    'PURCHASE AUTHORIZED ON 07/06 STANFORD HEALTH CA PALO ALTO' -> 'STANFORD HEALTH CA'
+
+Transactions are only grouped within an account, since a snippet belongs to one.
+"""
+from __future__ import annotations
+import re
+from typing import Collection, Dict, Iterable, List, Set, Tuple
+
+CLUSTER_KEY_WORDS = 3
+WORD_PUNCTUATION = '*#-,.:;()[]"'
+# upper cased words skipped at the start of a memo
+BOILERPLATE_WORDS = frozenset({
+    'PURCHASE', 'AUTHORIZED', 'ON', 'RECURRING', 'POS', 'DEBIT', 'CHECKCARD', 'CARD', 'WITH', 'PIN',
+})
+
+
+def cluster_key(memo, words: int = CLUSTER_KEY_WORDS, boilerplate: Collection[str] = BOILERPLATE_WORDS) -> str:
+    """the memo's first `words` words without digits, upper cased, after any leading boilerplate words. a memo with
+    no such words is its own key."""
+    kept = []
+    for word in str(memo).split():
+        word = word.strip(WORD_PUNCTUATION)
+        if not word or any(character.isdigit() for character in word):
+            continue
+        if not kept and word.upper() in boilerplate:
+            continue
+        kept.append(word.upper())
+        if len(kept) == words:
+            break
+    return ' '.join(kept) or str(memo).strip()
+
+
+def likely_snippet(memos: Iterable[str]) -> str:
+    """a guess at the snippet the user will pick for one or more memos: the first memo's text before its first word
+    with a digit in it (usually where store numbers, dates and reference numbers start), cut back a word at a time
+    until every memo contains it. falls back to the first memo's guess if no words are left."""
+    memos = [str(memo) for memo in memos]
+    first = memos[0]
+    end = len(first)
+    for word in re.finditer(r'\S+', first):
+        if any(character.isdigit() for character in word.group()):
+            end = word.start()
+            break
+    guess = first[:end].strip() or first.strip()
+    snippet = guess
+    while snippet and not all(snippet in memo for memo in memos[1:]):
+        snippet = snippet[:snippet.rfind(' ')].rstrip() if ' ' in snippet else ''
+    return snippet or guess
+
+
+class MemoClusters:
+    """The unmatched transactions grouped by account and cluster key, built once and then kept up to date: trimmed as
+    transactions get labelled and added to as new ones turn up.
+
+    Args:
+        transactions (Iterable[Tuple[int, int, str]]): (transaction_key, account_key, memo) for every unmatched
+            transaction
+    """
+
+    def __init__(self, transactions: Iterable[Tuple[int, int, str]] = ()):
+        # (account_key, cluster key) -> [(transaction_key, memo)], in transaction_key order
+        self._clusters: Dict[Tuple[int, str], List[Tuple[int, str]]] = {}
+        self.add(transactions)
+
+    def add(self, transactions: Iterable[Tuple[int, int, str]]):
+        """groups more (transaction_key, account_key, memo), ones that aren't in here yet"""
+        changed = set()
+        for transaction_key, account_key, memo in transactions:
+            key = (int(account_key), cluster_key(memo))
+            self._clusters.setdefault(key, []).append((int(transaction_key), memo))
+            changed.add(key)
+        for key in changed:
+            self._clusters[key].sort(key=lambda member: member[0])
+
+    @property
+    def transaction_keys(self) -> Set[int]:
+        return {transaction_key for members in self._clusters.values() for transaction_key, _ in members}
+
+    def __len__(self) -> int:
+        """the number of transactions, not clusters"""
+        return sum(len(members) for members in self._clusters.values())
+
+    @property
+    def num_clusters(self) -> int:
+        return len(self._clusters)
+
+    def largest(self) -> Tuple[int, List[Tuple[int, str]]] | None:
+        """(account_key, [(transaction_key, memo) for each member]) for the biggest cluster, the one with the earliest
+        transaction winning a tie. None once every transaction is labelled."""
+        if not self._clusters:
+            return None
+        key = max(self._clusters, key=lambda cluster: (len(self._clusters[cluster]), -self._clusters[cluster][0][0]))
+        return key[0], list(self._clusters[key])
+
+    def retain(self, transaction_keys: Set[int]):
+        """keeps only the transactions in transaction_keys, the ones still unmatched"""
+        for key in list(self._clusters):
+            members = [member for member in self._clusters[key] if member[0] in transaction_keys]
+            if members:
+                self._clusters[key] = members
+            else:
+                del self._clusters[key]
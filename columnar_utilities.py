@@ -0,0 +1,285 @@
+"""A small columnar store for processed statements.
+
+A table is saved as a folder ending in '.cols' with one raw binary file per column plus a meta.json describing
+them, so a reader can memory-map just the columns (and rows) it needs instead of parsing a whole CSV. Columns have
+one of five kinds:
+
+    'date'  - datetime64[D], NaT for missing
+    'float' - float64, NaN for missing
+    'cents' - money as int64 cents, stored and loaded like 'int' but written out as dollars by columnar_to_csv
+    'int'   - int64, with a <name>.na.bin bool mask for missing values
+    'text'  - utf-8 bytes in <name>.bin, int64 end offsets in <name>.offsets.bin, and a <name>.na.bin mask
+
+Only numpy and pandas are needed.
+"""
+from __future__ import annotations
+import json
+import os
+import shutil
+import tempfile
+from typing import Dict, List
+
+from import_utilities import lazy_import
+
+numpy = lazy_import('numpy')
+pandas = lazy_import('pandas')
+
+
+COLUMNAR_SUFFIX = '.cols'
+DATE_FORMAT = '%m/%d/%Y'
+
+# the columns of a processed statement table. anything else is inferred from its dtype.
+PROCESSED_COLUMN_KINDS = {
+    'Date': 'date',
+    'Memo': 'text',
+    'Amount': 'cents',
+    'account_key': 'int',
+    'snippet_key': 'int',
+    'content_hash': 'text',
+    'filename_key': 'int',
+}
+
+
+def columnar_path(directory, filename) -> str:
+    """where the columnar copy of a statement called filename lives inside directory"""
+    return os.path.join(directory, os.path.splitext(filename)[0] + COLUMNAR_SUFFIX)
+
+
+def is_columnar(path) -> bool:
+    return path.endswith(COLUMNAR_SUFFIX) and os.path.isfile(os.path.join(path, 'meta.json'))
+
+
+def infer_kind(series: pandas.Series) -> str:
+    kind = PROCESSED_COLUMN_KINDS.get(series.name)
+    if kind is not None:
+        return kind
+    if pandas.api.types.is_integer_dtype(series) or pandas.api.types.is_bool_dtype(series):
+        return 'int'
+    if pandas.api.types.is_float_dtype(series):
+        return 'float'
+    if pandas.api.types.is_datetime64_any_dtype(series):
+        return 'date'
+    return 'text'
+
+
+def _parse_dates(series: pandas.Series) -> pandas.Series | None:
+    """the column as datetimes, or None if some of it isn't in DATE_FORMAT"""
+    try:
+        return pandas.to_datetime(series, format=DATE_FORMAT)
+    except (ValueError, TypeError):
+        return None
+
+
+def _missing(series: pandas.Series) -> numpy.ndarray:
+    """NaN/None, and the '' the program uses for 'no value' in key columns"""
+    return (series.isna() | (series.astype(str) == '')).to_numpy()
+
+
+class ColumnarWriter:
+    """Writes a table to a .cols folder, one chunk at a time. Column kinds are set by the first chunk; a date column
+    that doesn't parse as DATE_FORMAT there is kept as text instead, and one that stops parsing in a later chunk is
+    turned into text then, with the dates already written going back out in DATE_FORMAT.
+
+    The chunks go to a hidden folder next to path, which replaces path only once close() has written all of it. If
+    the writing fails (or abort() is called) the hidden folder is removed and whatever was at path is left alone.
+
+    Args:
+        path (str): the .cols folder to write, replaced if it already exists
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+        self.columns: List[Dict] = []
+        self._files = {}
+        self._text_offsets = {}
+        parent, name = os.path.split(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        self._staging = tempfile.mkdtemp(prefix=f'.{name}.', suffix='.tmp', dir=parent)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _open(self, name):
+        self._files[name] = open(os.path.join(self._staging, name), 'wb')
+
+    def _start(self, table: pandas.DataFrame):
+        for name in table.columns:
+            kind = infer_kind(table[name])
+            if kind == 'date' and _parse_dates(table[name]) is None:
+                kind = 'text'
+            self.columns.append({'name': str(name), 'kind': kind})
+            self._open_column(str(name), kind)
+
+    def _open_column(self, name, kind):
+        self._open(f'{name}.bin')
+        if kind in ('int', 'cents', 'text'):
+            self._open(f'{name}.na.bin')
+        if kind == 'text':
+            self._open(f'{name}.offsets.bin')
+            self._text_offsets[name] = 0
+
+    def _dates_to_text(self, column: dict):
+        """rewrites a date column written so far as text"""
+        name = column['name']
+        self._files.pop(f'{name}.bin').close()
+        filepath = os.path.join(self._staging, f'{name}.bin')
+        dates = pandas.Series(numpy.fromfile(filepath, dtype='M8[D]').astype('M8[s]'))
+        column['kind'] = 'text'
+        self._open_column(name, 'text')
+        self._write_text(name, dates.dt.strftime(DATE_FORMAT))
+
+    def _write_text(self, name, series: pandas.Series):
+        missing = series.isna().to_numpy()
+        encoded = [b'' if is_missing else str(value).encode('utf-8') for value, is_missing in zip(series, missing)]
+        lengths = numpy.fromiter((len(value) for value in encoded), dtype='i8', count=len(encoded))
+        offsets = numpy.cumsum(lengths) + self._text_offsets[name]
+        if len(offsets):
+            self._text_offsets[name] = int(offsets[-1])
+        self._files[f'{name}.offsets.bin'].write(offsets.tobytes())
+        self._files[f'{name}.na.bin'].write(missing.tobytes())
+        self._files[f'{name}.bin'].write(b''.join(encoded))
+
+    def append(self, table: pandas.DataFrame):
+        if not self.columns:
+            self._start(table)
+        for column in self.columns:
+            name = column['name']
+            series = table[name]
+            if column['kind'] == 'date':
+                dates = _parse_dates(series)
+                if dates is None:
+                    self._dates_to_text(column)
+            kind = column['kind']
+            if kind == 'text':
+                self._write_text(name, series)
+                continue
+            if kind == 'date':
+                values = dates.to_numpy().astype('M8[D]')
+            elif kind == 'float':
+                values = pandas.to_numeric(series.replace('', numpy.nan)).to_numpy(dtype='f8')
+            elif kind in ('int', 'cents'):
+                missing = _missing(series)
+                values = pandas.to_numeric(series.where(~missing, 0)).to_numpy(dtype='i8')
+                self._files[f'{name}.na.bin'].write(missing.tobytes())
+            self._files[f'{name}.bin'].write(numpy.ascontiguousarray(values).tobytes())
+        self.rows += len(table)
+
+    def close(self):
+        """finishes the table and moves it into place"""
+        if self._staging is None:
+            return
+        try:
+            self._close_files()
+            with open(os.path.join(self._staging, 'meta.json'), 'w') as file:
+                json.dump({'rows': self.rows, 'columns': self.columns}, file, indent=2)
+        except BaseException:
+            self.abort()
+            raise
+        # a folder can't be renamed over one that has files in it, so the old one is moved aside first
+        replaced = None
+        if os.path.exists(self.path):
+            replaced = f'{self._staging}.old'
+            os.rename(self.path, replaced)
+        try:
+            os.rename(self._staging, self.path)
+        except OSError:
+            if replaced is not None:
+                os.rename(replaced, self.path)
+            self.abort()
+            raise
+        self._staging = None
+        if replaced is not None:
+            shutil.rmtree(replaced, ignore_errors=True)
+
+    def abort(self):
+        """throws away what has been written, leaving path as it was"""
+        if self._staging is None:
+            return
+        self._close_files()
+        shutil.rmtree(self._staging, ignore_errors=True)
+        self._staging = None
+
+    def _close_files(self):
+        for file in self._files.values():
+            file.close()
+        self._files = {}
+
+
+def save_columnar(table: pandas.DataFrame, path):
+    with ColumnarWriter(path) as writer:
+        writer.append(table)
+
+
+def read_meta(path) -> dict:
+    with open(os.path.join(path, 'meta.json')) as file:
+        return json.load(file)
+
+
+def _map(path, name, dtype, count) -> numpy.ndarray:
+    """memory-maps a column file. numpy can't map an empty file, so empty columns are plain empty arrays."""
+    if count == 0 or os.path.getsize(os.path.join(path, name)) == 0:
+        return numpy.empty(0, dtype=dtype)
+    return numpy.memmap(os.path.join(path, name), dtype=dtype, mode='r', shape=(count,))
+
+
+def load_columnar(path, columns: List[str] = None, start: int = 0, stop: int = None) -> pandas.DataFrame:
+    """Reads rows [start, stop) of the requested columns (all of them by default) from a .cols folder. Only the
+    pages of the mapped files covering those rows and columns are actually read from disk."""
+    meta = read_meta(path)
+    rows = meta['rows']
+    stop = rows if stop is None else min(stop, rows)
+    start = min(start, stop)
+    wanted = meta['columns'] if columns is None else [
+        column for name in columns for column in meta['columns'] if column['name'] == name
+    ]
+    data = {}
+    for column in wanted:
+        name, kind = column['name'], column['kind']
+        if kind == 'date':
+            data[name] = pandas.Series(_map(path, f'{name}.bin', 'M8[D]', rows)[start:stop].astype('M8[s]'))
+        elif kind == 'float':
+            data[name] = pandas.Series(numpy.array(_map(path, f'{name}.bin', 'f8', rows)[start:stop]))
+        elif kind in ('int', 'cents'):
+            values = numpy.array(_map(path, f'{name}.bin', 'i8', rows)[start:stop])
+            missing = numpy.array(_map(path, f'{name}.na.bin', 'bool', rows)[start:stop])
+            data[name] = pandas.Series(pandas.arrays.IntegerArray(values, missing))
+        else:
+            ends = _map(path, f'{name}.offsets.bin', 'i8', rows)
+            missing = _map(path, f'{name}.na.bin', 'bool', rows)
+            text_bytes = _map(path, f'{name}.bin', 'u1', int(ends[-1]) if rows else 0)
+            values = []
+            for row in range(start, stop):
+                if missing[row]:
+                    values.append(None)
+                    continue
+                begin = int(ends[row - 1]) if row else 0
+                values.append(text_bytes[begin:int(ends[row])].tobytes().decode('utf-8'))
+            data[name] = pandas.Series(values, dtype=object)
+    table = pandas.DataFrame(data)
+    table.index = pandas.RangeIndex(start, start + len(table))
+    return table
+
+
+def iter_columnar(path, columns: List[str] = None, chunk_rows: int = 10000):
+    """load_columnar chunk_rows rows at a time, for going through a table without having all of it in memory"""
+    rows = read_meta(path)['rows']
+    for start in range(0, rows, chunk_rows):
+        yield load_columnar(path, columns, start, start + chunk_rows)
+
+
+def columnar_to_csv(path, csv_filepath):
+    """exports a .cols folder as a CSV, with dates written back out in DATE_FORMAT and money in dollars"""
+    table = load_columnar(path)
+    for column in read_meta(path)['columns']:
+        if column['kind'] == 'date':
+            table[column['name']] = table[column['name']].dt.strftime(DATE_FORMAT)
+        elif column['kind'] == 'cents':
+            table[column['name']] = table[column['name']] / 100
+    table.to_csv(csv_filepath, index=False)
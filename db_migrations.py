@@ -0,0 +1,163 @@
+"""Versioned schema migrations for session databases.
+
+initialize_db creates the version 0 schema. Everything after that is a migration in MIGRATIONS, and the version a
+database is at is kept in sqlite's `PRAGMA user_version`, so opening an older session's database brings it up to
+date in place. To change the schema, append a new migration with the next version number; never edit one that has
+already shipped.
+"""
+from __future__ import annotations
+import sqlite3
+from typing import Callable, List, Tuple
+
+from import_utilities import lazy_import
+from ingest_utilities import normalize_amounts, normalize_hash_amount, transaction_hash
+from sqlite_utilities import DbSession
+
+pandas = lazy_import('pandas')
+
+
+def fts5_trigram_available(conn: DbSession) -> bool:
+    """the trigram tokenizer needs sqlite 3.34+ built with fts5"""
+    try:
+        conn.connection.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x, tokenize='trigram')")
+        conn.connection.execute("DROP TABLE temp.fts5_probe")
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+def create_memo_index(conn: DbSession):
+    """an external content fts5 trigram index over transactions.memo, kept in sync by triggers. sqlite builds
+    without trigram support just skip it and snippet_memo_filter leaves the snippet queries as plain scans."""
+    if not fts5_trigram_available(conn):
+        conn.print('fts5 trigram tokenizer not available, skipping the memo index')
+        return
+    conn.commit_query("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS transactions_memo_fts USING fts5(
+            memo,
+            content='transactions',
+            content_rowid='transaction_key',
+            tokenize='trigram'
+        )
+    """)
+    conn.commit_query("""
+        CREATE TRIGGER IF NOT EXISTS transactions_memo_fts_insert AFTER INSERT ON transactions BEGIN
+            INSERT INTO transactions_memo_fts (rowid, memo) VALUES (new.transaction_key, new.memo);
+        END
+    """)
+    conn.commit_query("""
+        CREATE TRIGGER IF NOT EXISTS transactions_memo_fts_delete AFTER DELETE ON transactions BEGIN
+            INSERT INTO transactions_memo_fts (transactions_memo_fts, rowid, memo)
+            VALUES ('delete', old.transaction_key, old.memo);
+        END
+    """)
+    conn.commit_query("""
+        CREATE TRIGGER IF NOT EXISTS transactions_memo_fts_update AFTER UPDATE OF memo ON transactions BEGIN
+            INSERT INTO transactions_memo_fts (transactions_memo_fts, rowid, memo)
+            VALUES ('delete', old.transaction_key, old.memo);
+            INSERT INTO transactions_memo_fts (rowid, memo) VALUES (new.transaction_key, new.memo);
+        END
+    """)
+    conn.commit_query("INSERT INTO transactions_memo_fts (transactions_memo_fts) VALUES ('rebuild')")
+
+
+def backfill_content_hashes(conn: DbSession):
+    """hashes the transactions already in the database. ordinals are counted within each file, like they are at
+    ingest. rows that duplicate one from an earlier file (the same statement imported under two names) keep a NULL
+    hash, so they're left alone here and dropped the next time their file is imported."""
+    rows = conn.connection.execute("""
+        SELECT transaction_key, filename_key, account_key, date, memo, amount
+        FROM transactions
+        ORDER BY transaction_key
+    """).fetchall()
+    occurrences = {}
+    seen_hashes = set()
+    updates = []
+    for transaction_key, filename_key, account_key, date, memo, amount in rows:
+        identity = (str(account_key), str(date), str(memo), normalize_hash_amount(amount))
+        ordinal = occurrences.get((filename_key, identity), 0)
+        occurrences[(filename_key, identity)] = ordinal + 1
+        content_hash = transaction_hash(*identity, ordinal)
+        if content_hash in seen_hashes:
+            continue
+        seen_hashes.add(content_hash)
+        updates.append((content_hash, transaction_key))
+    conn.commit_many("UPDATE transactions SET content_hash = ? WHERE transaction_key = ?", updates)
+    conn.print(f'hashed {len(updates)} transactions, {len(rows) - len(updates)} duplicates left unhashed')
+
+
+def convert_amounts_to_cents(conn: DbSession):
+    """rewrites transactions.amount from dollars (stored as reals, integers or text) to integer cents. amounts that
+    can't be parsed are left as they are and counted."""
+    rows = conn.connection.execute("SELECT transaction_key, amount FROM transactions").fetchall()
+    if not rows:
+        return
+    keys = [transaction_key for transaction_key, _ in rows]
+    amounts = pandas.Series([amount for _, amount in rows], dtype=object)
+    cents = normalize_amounts(amounts, errors='coerce')
+    updates = [(int(cent), transaction_key) for cent, transaction_key in zip(cents, keys) if cent is not pandas.NA]
+    conn.commit_many("UPDATE transactions SET amount = ? WHERE transaction_key = ?", updates)
+    skipped = int((cents.isna() & amounts.notna()).sum())
+    conn.print(f'converted {len(updates)} amounts to cents, {skipped} unparseable amounts left as they were')
+
+
+# (version, description, steps). a step is a sql string or a callable taking the DbSession
+MIGRATIONS: List[Tuple[int, str, List[str | Callable]]] = [
+    (1, 'secondary indexes for lookups and the transactions_view joins', [
+        "CREATE INDEX IF NOT EXISTS idx_transactions_snippet_key ON transactions (snippet_key)",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_filename_key ON transactions (filename_key)",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_account_key ON transactions (account_key)",
+        "CREATE INDEX IF NOT EXISTS idx_vendors_vendor_id ON vendors (vendor_id)",
+        "CREATE INDEX IF NOT EXISTS idx_types_type_id ON types (type_id)",
+        "CREATE INDEX IF NOT EXISTS idx_snippets_source_account_key ON snippets (source_account_key)",
+        "CREATE INDEX IF NOT EXISTS idx_filenames_filename_id ON filenames (filename_id)",
+        "ANALYZE",
+    ]),
+    (2, 'fts5 trigram index over transactions.memo for snippet previews', [
+        create_memo_index,
+    ]),
+    (3, 'content hash identity for transactions so re-imports skip rows already present', [
+        "ALTER TABLE transactions ADD COLUMN content_hash VARCHAR(40)",
+        backfill_content_hashes,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_content_hash ON transactions (content_hash)",
+    ]),
+    (4, 'file fingerprints on filenames so unchanged statements can be skipped', [
+        "ALTER TABLE filenames ADD COLUMN file_size INTEGER",
+        "ALTER TABLE filenames ADD COLUMN file_mtime REAL",
+        "ALTER TABLE filenames ADD COLUMN file_hash VARCHAR(64)",
+    ]),
+    (5, 'transactions.amount stored as integer cents', [
+        convert_amounts_to_cents,
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn: DbSession) -> int:
+    # read straight off the connection, opening a session shouldn't have to load pandas for one number
+    return int(conn.connection.execute('PRAGMA user_version').fetchone()[0])
+
+
+def migrate_database(filepath, target_version: int = LATEST_VERSION) -> int:
+    """applies every migration newer than the database's current version, each in its own transaction together with
+    the version bump, so a failed migration leaves the database at the last version that fully applied.
+
+    :return: the schema version the database ends up at
+    """
+    with DbSession(filepath) as conn:
+        version = get_schema_version(conn)
+        for migration_version, description, steps in MIGRATIONS:
+            if migration_version <= version or migration_version > target_version:
+                continue
+            conn.print(f'migrating schema to version {migration_version}: {description}')
+            with conn.transaction():
+                conn.commit_query('BEGIN')  # DDL doesn't open a transaction on its own
+                for step in steps:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.commit_query(step)
+                conn.commit_query(f'PRAGMA user_version = {migration_version}')
+            version = migration_version
+    return version
@@ -1,21 +1,41 @@
 import sqlite3
-import pandas
+import time
+
+from pager_utilities import MAX_ROWS, Pager, browse
 
 database_filepath = input('database filepath:'
                           '> ')
 
+max_rows = MAX_ROWS
 with sqlite3.connect(database_filepath) as conn:
     user_input = ''
     while user_input.upper() != 'EXIT':
         user_input = input('\n\nnew query:\n')
+        words = user_input.split()
+        if len(words) == 2 and words[0].upper() == 'ROWS' and (words[1].isdigit() or words[1].upper() == 'ALL'):
+            # changes how many rows of a result are read at most
+            max_rows = None if words[1].upper() == 'ALL' else int(words[1])
+            print(f'showing {"all rows" if max_rows is None else f"up to {max_rows} rows"} of each result')
+            continue
         if user_input.upper() not in ('', 'EXIT', 'COMMIT'):
+            cursor = conn.cursor()
             try:
-                results = pandas.read_sql_query(user_input, conn)
-                print(results.to_string())
-            except TypeError as err:
-                print(f"WARNING: '{err}' thrown, ignore if you entered an update query")
+                start = time.perf_counter()
+                cursor.execute(user_input)
+                print(f'ran in {1000 * (time.perf_counter() - start):.1f}ms')
+                if cursor.description is None:  # an update or some other statement without results
+                    print(f'{max(cursor.rowcount, 0)} rows changed')
+                else:
+                    pager = Pager.from_cursor(cursor, max_rows=max_rows)
+                    browse(pager, wait=False, show_time=True)
+                    if pager.truncated:
+                        print("enter 'ROWS <number>' or 'ROWS ALL' to change the limit")
+            except sqlite3.Error as err:
+                print(f"WARNING: '{err}' thrown")
+            finally:
+                cursor.close()
         if user_input.upper() == 'COMMIT':
             conn.commit()
-
-
-
+            # a program already running on this database keeps its lookups cached, it can't see this commit
+            print('committed. restart any session open on this database to pick up changed types, vendors, '
+                  'accounts or snippets')
@@ -0,0 +1,50 @@
+"""Deferred imports for the heavy libraries, so the program's menus come up without waiting on them.
+
+    pandas = lazy_import('pandas')
+
+binds a stand-in that imports pandas the first time one of its attributes is used, and behaves like the module from
+then on. Modules that do this need `from __future__ import annotations`, otherwise their annotations would use the
+module as soon as they're defined. Until the first use the library is not in sys.modules, so
+`is_imported('pandas')` tells whether anything has needed it yet.
+"""
+import importlib
+import sys
+import threading
+
+
+class LazyModule:
+    """Stands in for a module until something needs it.
+
+    Args:
+        name (str): the module's import name
+    """
+
+    def __init__(self, name):
+        self.__name = name
+        self.__module = None
+        self.__lock = threading.Lock()
+
+    def __load(self):
+        with self.__lock:
+            if self.__module is None:
+                self.__module = importlib.import_module(self.__name)
+        return self.__module
+
+    def __getattr__(self, attribute):
+        # only called for attributes the stand-in doesn't have itself, which is all of the module's
+        return getattr(self.__module or self.__load(), attribute)
+
+    def __dir__(self):
+        return dir(self.__module or self.__load())
+
+    def __repr__(self):
+        state = 'imported' if self.__module is not None else 'not imported yet'
+        return f'<lazy module {self.__name!r}, {state}>'
+
+
+def lazy_import(name) -> LazyModule:
+    return LazyModule(name)
+
+
+def is_imported(name) -> bool:
+    return name in sys.modules
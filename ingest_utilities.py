@@ -0,0 +1,146 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+from typing import Any, List
+
+from import_utilities import lazy_import
+
+numpy = lazy_import('numpy')
+pandas = lazy_import('pandas')
+
+
+def normalize_hash_amount(amount: Any) -> str:
+    """dollar amounts come in as '300', '300.0', 300 or 300.0 depending on the path they took, so they're put in one
+    format before hashing. gives the same text as format_cents does for the amount in cents."""
+    try:
+        return f'{float(amount):.2f}'
+    except (TypeError, ValueError):
+        return str(amount)
+
+
+def normalize_amounts(amounts, errors: str = 'raise') -> pandas.Series:
+    """Vectorized conversion of statement amounts to exact integer cents. Takes numbers or text like '12.5',
+    '-1,234.56', '$1,234.56', '(12.00)' (negative) or '12.00-' (negative). Missing values come back as <NA>.
+
+    :param errors: passed to pandas.to_numeric, 'coerce' turns anything unparseable into <NA> instead of raising
+    """
+    amounts = pandas.Series(amounts)
+    if pandas.api.types.is_numeric_dtype(amounts):
+        dollars = amounts.astype('float64')
+    else:
+        text = amounts.where(amounts.notna(), '').astype(str).str.strip()
+        negative = (text.str.startswith('(') & text.str.endswith(')')) | text.str.endswith('-')
+        cleaned = text.str.replace(r'[\s$,()]', '', regex=True).str.rstrip('-')
+        dollars = pandas.to_numeric(cleaned, errors=errors).astype('float64')
+        dollars = dollars.where(~negative, -dollars.abs())
+    # amounts have at most two decimals, so rounding after scaling gives the exact cents
+    return numpy.rint(dollars * 100).astype('Int64')
+
+
+def format_cents(cents) -> str:
+    """integer cents as a plain dollar string, '-13.63'. missing amounts come out as 'nan'."""
+    if cents is None or pandas.isna(cents):
+        return 'nan'
+    cents = int(cents)
+    sign = '-' if cents < 0 else ''
+    return f'{sign}{abs(cents) // 100}.{abs(cents) % 100:02d}'
+
+
+def transaction_hash(account_key, date, memo, amount, ordinal: int) -> str:
+    """deterministic identity for a transaction. ordinal is which occurrence of the same account/date/memo/amount this
+    is within its statement, so genuine same-day duplicates don't collapse into one row."""
+    key = '\x1f'.join([str(account_key), str(date), str(memo), normalize_hash_amount(amount), str(ordinal)])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+class OccurrenceCounts:
+    """How many times each account/date/memo/amount has come up so far in a statement that's being hashed a chunk at
+    a time. The counts are kept in a throwaway sqlite file rather than a dict, so memory stays the same however many
+    rows the statement has. Identities are keyed by a 64 bit digest; two of them sharing one (around a one in a
+    million chance over ten million distinct rows) would only throw off those rows' ordinals. Use it as a context
+    manager, the file is deleted on exit.
+
+    Args:
+        directory (str): where the file goes, the system's temp folder by default
+        cache_kib (int): the most memory sqlite uses for its page cache
+    """
+
+    def __init__(self, directory=None, cache_kib: int = 8192):
+        handle, self.path = tempfile.mkstemp(prefix='occurrences_', suffix='.db', dir=directory)
+        os.close(handle)
+        self.connection = sqlite3.connect(self.path)
+        for pragma in ('journal_mode = OFF', 'synchronous = OFF', f'cache_size = -{cache_kib}'):
+            self.connection.execute(f'PRAGMA {pragma}')
+        self.connection.execute('CREATE TABLE counts (identity INTEGER PRIMARY KEY, count INTEGER)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    @staticmethod
+    def digest(identity: tuple) -> int:
+        key = '\x1f'.join(identity).encode('utf-8')
+        return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'big', signed=True)
+
+    def ordinals(self, identities: List[tuple]) -> List[int]:
+        """the ordinal of each identity: how many times it came up before, earlier in the list or in earlier calls"""
+        digests = [self.digest(identity) for identity in identities]
+        counts = dict(self.connection.execute(
+            'SELECT identity, count FROM counts WHERE identity IN (SELECT value FROM json_each(?))',
+            (json.dumps(list(set(digests))),)))
+        ordinals = []
+        for digest in digests:
+            ordinal = counts.get(digest, 0)
+            ordinals.append(ordinal)
+            counts[digest] = ordinal + 1
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO counts (identity, count) VALUES (?, ?)',
+                                        counts.items())
+        return ordinals
+
+
+def add_content_hashes(data: pandas.DataFrame, occurrences: OccurrenceCounts = None) -> pandas.DataFrame:
+    """adds a content_hash column to a table with Date, Memo, Amount (in cents) and account_key columns. quotes are
+    left out of the memo for the hash because memos used to be stored with them stripped, and rows from then still
+    have to be recognised when their statement is imported again.
+
+    when a statement is hashed in chunks, pass the same OccurrenceCounts for every chunk so the ordinals carry on
+    across chunk boundaries.
+    """
+    memos = data['Memo'].astype(str).str.replace("'", '', regex=False)
+    identities = list(zip(data['account_key'].astype(str), data['Date'].astype(str), memos,
+                          data['Amount'].map(format_cents)))
+    if occurrences is None:
+        counts = {}
+        ordinals = []
+        for identity in identities:
+            ordinals.append(counts.get(identity, 0))
+            counts[identity] = ordinals[-1] + 1
+    else:
+        ordinals = occurrences.ordinals(identities)
+    data['content_hash'] = [transaction_hash(*identity, ordinal) for identity, ordinal in zip(identities, ordinals)]
+    return data
+
+
+def file_fingerprint(filepath, block_size: int = 1 << 20) -> dict:
+    """size, mtime and sha256 of a statement file, for telling whether it changed since it was last imported"""
+    stat = os.stat(filepath)
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return {
+        'file_size': stat.st_size,
+        'file_mtime': stat.st_mtime,
+        'file_hash': digest.hexdigest(),
+    }
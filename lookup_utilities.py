@@ -0,0 +1,139 @@
+"""An in-process cache of the small dimension tables: types, vendors, accounts and snippets.
+
+Each table is read whole the first time something asks for it and kept until a write helper invalidates it, so the
+id -> key lookups and lists the menus need are dict hits instead of a query each. There is one cache per database
+file (see get_lookup_cache), which keeps sessions in different folders apart.
+"""
+from __future__ import annotations
+import os
+import threading
+from typing import Any, Callable, Dict, List
+
+from import_utilities import lazy_import
+from snippet_utilities import SnippetMatcher
+from sqlite_utilities import DbSession
+
+pandas = lazy_import('pandas')
+
+
+class LookupCache:
+    """Lazily loaded copies of the dimension tables of one database, plus things derived from them.
+
+    Args:
+        filepath (str): the database file
+    """
+
+    TABLES = ('types', 'vendors', 'accounts', 'snippets')
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.loads = 0
+        self._tables: Dict[str, pandas.DataFrame] = {}
+        # name -> (table it was built from, value)
+        self._derived: Dict[str, tuple] = {}
+        self._lock = threading.RLock()
+
+    def invalidate(self, *tables: str):
+        """forgets the given tables (all of them by default) and everything built from them"""
+        tables = tables or self.TABLES
+        with self._lock:
+            for table in tables:
+                self._tables.pop(table, None)
+            self._derived = {name: derived for name, derived in self._derived.items() if derived[0] not in tables}
+
+    def table(self, name) -> pandas.DataFrame:
+        """the whole table, in table order. treat it as read only."""
+        with self._lock:
+            if name not in self._tables:
+                with DbSession(self.filepath) as conn:
+                    self._tables[name] = conn.fetch_query(f"SELECT * FROM {name}")
+                self.loads += 1
+            return self._tables[name]
+
+    def _derive(self, name, table, build: Callable[[pandas.DataFrame], Any]):
+        with self._lock:
+            if name not in self._derived:
+                self._derived[name] = (table, build(self.table(table)))
+            return self._derived[name][1]
+
+    def type_ids(self) -> List[str]:
+        return self._derive('type_ids', 'types', lambda types: types['type_id'].tolist())
+
+    def type_keys(self) -> Dict[str, int]:
+        return self._derive('type_keys', 'types', lambda types: _key_dict(types, 'type_id', 'type_key'))
+
+    def vendor_ids(self) -> List[str]:
+        return self._derive('vendor_ids', 'vendors', lambda vendors: vendors['vendor_id'].tolist())
+
+    def vendor_keys(self) -> Dict[str, int]:
+        return self._derive('vendor_keys', 'vendors', lambda vendors: _key_dict(vendors, 'vendor_id', 'vendor_key'))
+
+    def account_ids(self) -> List[str]:
+        return self._derive('account_ids', 'accounts', lambda accounts: accounts['account_id'].tolist())
+
+    def account_keys(self) -> Dict[str, int]:
+        return self._derive('account_keys', 'accounts',
+                            lambda accounts: _key_dict(accounts, 'account_id', 'account_key'))
+
+    def account_row(self, account_key) -> pandas.Series | None:
+        """a copy of the accounts row for account_key, or None"""
+        rows = self._derive('account_rows', 'accounts', lambda accounts: {
+            int(key): position for position, key in enumerate(accounts['account_key'])
+        })
+        position = rows.get(int(account_key))
+        if position is None:
+            return None
+        return self.table('accounts').iloc[position].copy()
+
+    def account_snippet_pairs(self, account_key) -> list:
+        """(snippet, snippet_key) for every snippet on an account, in table order"""
+        pairs = self._derive('account_snippet_pairs', 'snippets', _snippet_pairs_by_account)
+        return list(pairs.get(int(account_key), []))
+
+    def filename_snippets(self) -> pandas.DataFrame:
+        """the snippets that identify an account from a statement's filename (no vendor or type), in table order"""
+        return self._derive('filename_snippets', 'snippets', lambda snippets: snippets.loc[
+            snippets['type_key'].isna() & snippets['vendor_key'].isna(),
+            ['snippet_key', 'snippet', 'source_account_key']
+        ].reset_index(drop=True))
+
+    def filename_matcher(self) -> SnippetMatcher:
+        """matches a filename to its source_account_key, first filename snippet in table order wins"""
+        def build(_):
+            filename_snippets = self.filename_snippets()
+            return SnippetMatcher(zip(filename_snippets['snippet'],
+                                      (int(key) for key in filename_snippets['source_account_key'])))
+        return self._derive('filename_matcher', 'snippets', build)
+
+
+def _key_dict(table: pandas.DataFrame, id_column, key_column) -> Dict[Any, int]:
+    # the first row wins when an id is repeated, like the `fetch_single_value` lookups this replaces
+    keys = {}
+    for id_value, key in zip(table[id_column], table[key_column]):
+        keys.setdefault(id_value, int(key))
+    return keys
+
+
+def _snippet_pairs_by_account(snippets: pandas.DataFrame) -> Dict[int, list]:
+    pairs = {}
+    for snippet, snippet_key, account_key in zip(snippets['snippet'], snippets['snippet_key'],
+                                                 snippets['source_account_key']):
+        if pandas.isna(account_key):
+            continue
+        pairs.setdefault(int(account_key), []).append((snippet, int(snippet_key)))
+    return pairs
+
+
+_caches: Dict[str, LookupCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_lookup_cache(filepath) -> LookupCache:
+    """the cache for a database file. like the connection manager, relative paths are pinned down when first seen
+    because the program moves between session folders with os.chdir."""
+    path = os.path.abspath(filepath)
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = _caches[path] = LookupCache(path)
+    return cache
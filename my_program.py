@@ -1,23 +1,52 @@
+from __future__ import annotations
 import datetime
+import json
 import os
+import shutil
 import sqlite3
+import sys
 import time
 import logging
+import numbers
+import concurrent.futures
 from typing import List, Any
 
-import pandas
+from cluster_utilities import MemoClusters, likely_snippet
+from columnar_utilities import (COLUMNAR_SUFFIX, DATE_FORMAT, ColumnarWriter, columnar_path, columnar_to_csv,
+                                is_columnar, iter_columnar, save_columnar)
+from db_migrations import migrate_database
+from import_utilities import lazy_import
+from ingest_utilities import OccurrenceCounts, add_content_hashes, file_fingerprint, format_cents, normalize_amounts
+from lookup_utilities import get_lookup_cache
+from pager_utilities import MAX_ROWS, FrameChunks, Pager, browse
+from profiling_utilities import profiler
+from snippet_utilities import SnippetMatcher, snippet_overlaps
+from sqlite_utilities import DbSession, connection_manager, query_stats, quiet_sessions
+from suggestion_utilities import SnippetSuggester
 
-from sqlite_utilities import DbSession
+pandas = lazy_import('pandas')
 
 
 # boilerplate
 database = 'persistent_data.db'
+# statements bigger than this are streamed into the database in chunks instead of being loaded whole
+STREAMING_THRESHOLD_BYTES = 64 * 1024 * 1024
+STREAMING_CHUNK_ROWS = 50000
+# rows read at a time from a saved file being paged through
+VIEW_CHUNK_ROWS = 1000
 
 logger = logging.getLogger('my_app')
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(module)s - %(funcName)s - %(lineno)d - %(message)s'
-)
+
+
+def configure_logging():
+    """the program's logging setup, done by main() rather than on import so importing this module (the benchmarks,
+    other scripts) leaves logging alone"""
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(module)s - %(funcName)s - %(lineno)d - %(message)s'
+    )
+    # every sql statement is logged at DEBUG, set this to logging.DEBUG to see them. slow queries are logged at WARNING.
+    logging.getLogger('my_app.sql').setLevel(logging.INFO)
 
 
 class Menu:
@@ -194,6 +223,8 @@ def start_menu() -> None:
         create_new_session()
     else:
         os.chdir(session)
+        # bring databases from older versions of the program up to the current schema
+        migrate_database(database)
 
 
 def create_new_session() -> None:
@@ -327,6 +358,10 @@ def initialize_db() -> None:
                 ON filenames.filename_key = transactions.filename_key
         """
         conn.commit_query(create_transactions_view)
+    # everything newer than the base schema lives in the migrations
+    migrate_database('persistent_data.db')
+    # a session recreated under an old name mustn't see what was cached for the last one
+    get_lookup_cache(database).invalidate()
 
 
 # main menu
@@ -338,6 +373,8 @@ def main_menu():
         choices=[
             ('view saved data', view_saved_data_menu),
             ('add new raw data', add_new_raw_data),
+            ('add a folder of raw data', add_raw_data_directory),
+            ('reprocess raw data (even if unchanged)', lambda: add_new_raw_data(force=True)),
             ('Browse DB', db_browser)
         ],
         zero_choice=('Exit', quit_program)
@@ -349,8 +386,10 @@ def view_saved_data_menu():
     func = Menu.deploy(
         title='Saved data menu',
         choices=[
-            ('read trimmed data', open_processed_csv),
+            ('read trimmed data', open_processed_data),
             ('check db tables', check_db_tables),
+            ('check snippets for overlaps', snippet_overlap_report),
+            ('edit a snippet', edit_snippet_menu),
             ('rectify unmatched transactions', match_unmatched_transactions)
         ],
         zero_choice=('Back', main_menu)
@@ -358,8 +397,9 @@ def view_saved_data_menu():
     func()
 
 
-def add_new_raw_data():
-    """workflow for adding new raw_data to the program storage"""
+def add_new_raw_data(force: bool = False):
+    """workflow for adding new raw_data to the program storage. a file that's byte-for-byte the same as when it was
+    last imported is skipped, unless force is set."""
 
     # user gives filepath to new data, program reads data
     filepath = input('enter filepath for new raw_data and press enter, or just press enter to go back:\n'
@@ -368,169 +408,524 @@ def add_new_raw_data():
         main_menu()
     if not filepath.endswith('.csv'):
         raise Exception('data must be from a csv file')
+    import_raw_file(filepath, force)
+
+    # go back to main menu
+    main_menu()
+
+
+def import_raw_file(filepath, force: bool = False, chunk_rows: int = None):
+    """copies one statement into raw_data, parses it with its account's settings (asking the user for the account if
+    it can't be detected from the filename) and loads it into the database and processed_data. files bigger than
+    STREAMING_THRESHOLD_BYTES, or any file if chunk_rows is given, go through stream_raw_file instead."""
     filename = os.path.basename(filepath)
-    try:
-        data = pandas.read_csv(filepath, header=None)
-    except FileNotFoundError as err:
-        print(f"file '{filepath}' not found. Make sure its entire filepath is entered")
-        return main_menu()
+    with profiler.run(f'import {filename}'):
+        with profiler.span('unchanged check'):
+            unchanged = not force and os.path.isfile(filepath) and file_is_unchanged(filename, filepath)
+        if unchanged:
+            print(f"'{filename}' hasn't changed since it was last imported, skipping it")
+            return
+        try:
+            with profiler.span('fingerprint'):
+                fingerprint = file_fingerprint(filepath)
+            if chunk_rows is None and fingerprint['file_size'] > STREAMING_THRESHOLD_BYTES:
+                chunk_rows = STREAMING_CHUNK_ROWS
+            if chunk_rows:
+                return stream_raw_file(filepath, fingerprint, chunk_rows)
+        except FileNotFoundError as err:
+            print(f"file '{filepath}' not found. Make sure its entire filepath is entered")
+            return
 
-    # program copies it into the raw_data folder
-    os.chdir('raw_data')  # go into the folder
-    data.to_csv(filename, index=False, header=None)  # 'paste it'
-    os.chdir('..')  # go back to the base filepath
+        # program copies it into the raw_data folder
+        with profiler.span('copy to raw_data'):
+            shutil.copyfile(filepath, os.path.join('raw_data', filename))
 
-    # process the data
-    account_key = get_account_key_from_filename(filename)  # attempt to autodetect the account
-    if account_key is None:  # if not, get it from the user
-        account_key = get_account_key_from_prompt(filename, data)
-    account_data = get_account_data(account_key)  # get the information from the database for parsing the file
-    table = make_table(account_data, data, filename)  # format the table
+        # process the data
+        with profiler.span('account detection'):
+            account_key = get_account_key_from_filename(filename)  # attempt to autodetect the account
+            sample = read_statement_sample(filepath) if account_key is None else None
+        if account_key is None:  # if not, get it from the user
+            with profiler.waiting():
+                account_key = get_account_key_from_prompt(filename, sample)
+        with profiler.span('account detection'):
+            account_data = get_account_data(account_key)  # get the information from the database for parsing the file
+        table = make_table(account_data, filepath, show=True)  # the one and only parse of the file
 
-    add_new_transaction_data_to_database(account_data, table, filename)
+        add_new_transaction_data_to_database(account_data, table, filename, fingerprint=fingerprint)
 
-    # put the processed data into processed data folder
-    os.chdir('processed_data')  # go into the folder
-    table.to_csv(filename, index=False)  # 'paste it'
-    os.chdir('..')  # go back to base filepath
+        # put the processed data into processed data folder
+        with profiler.span('processed write'):
+            save_columnar(table, columnar_path('processed_data', filename))
 
-    # go back to main menu
+
+def stream_raw_file(filepath, fingerprint: dict, chunk_rows: int = None) -> int:
+    """Streaming version of import_raw_file for statements too big to hold in memory a few times over. The file is
+    copied into raw_data as-is, then read chunk_rows rows at a time; each chunk is trimmed, classified, inserted and
+    appended to processed_data before the next one is read. All the chunks go into one transaction, so the database
+    ends up the same as with the non-streaming path and a failure leaves nothing half-written.
+
+    :return: the number of new transactions inserted
+    """
+    start_time = time.perf_counter()
+    chunk_rows = chunk_rows or STREAMING_CHUNK_ROWS
+    filename = os.path.basename(filepath)
+    with profiler.span('copy to raw_data'):
+        shutil.copyfile(filepath, os.path.join('raw_data', filename))
+    with profiler.span('account detection'):
+        account_key = get_account_key_from_filename(filename)  # attempt to autodetect the account
+        sample = read_statement_sample(filepath) if account_key is None else None
+    if account_key is None:  # if not, get it from the user with a sample of the file
+        with profiler.waiting():
+            account_key = get_account_key_from_prompt(filename, sample)
+    with profiler.span('account detection'):
+        account_data = get_account_data(account_key)
+        matcher = SnippetMatcher(get_account_snippet_pairs(account_key))
+    total_rows = new_rows = 0
+    # content hash ordinals carry on from one chunk to the next, counted on disk so memory doesn't grow with the file
+    with OccurrenceCounts() as occurrences, DbSession(database) as conn, \
+            ColumnarWriter(columnar_path('processed_data', filename)) as processed:
+        with conn.transaction():
+            filename_key = start_filename_import(conn, filename)
+            chunks = read_statement_chunks(filepath, account_data, chunk_rows)
+            while True:
+                with profiler.span('read'):
+                    chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                with profiler.span('trim'):
+                    table = trim_table(account_data, chunk)
+                with profiler.span('classify'):
+                    prepare_transaction_table(table, account_key, matcher, occurrences)
+                with profiler.span('database write'):
+                    new_rows += insert_transaction_rows(conn, table, filename_key)
+                with profiler.span('processed write'):
+                    processed.append(table)
+                total_rows += len(table)
+            record_file_fingerprint(conn, filename_key, fingerprint)
+    elapsed = time.perf_counter() - start_time
+    print(f'streamed {total_rows} rows from {filename} in chunks of {chunk_rows}: {new_rows} new, '
+          f'{total_rows - new_rows} already present ({elapsed:.3f}s, {total_rows / max(elapsed, 1e-9):.0f} rows/sec)')
+    return new_rows
+
+
+def add_raw_data_directory(force: bool = False):
+    """workflow for adding every statement in a folder at once. files whose account can't be detected from the
+    filename are set aside and offered to the user at the end, so they don't hold up the rest."""
+    directory = input('enter the folder holding the new raw_data and press enter, or just press enter to go back:\n'
+                      '> ')
+    if directory == '':
+        return main_menu()
+    if not os.path.isdir(directory):
+        print(f"folder '{directory}' not found. Make sure its entire filepath is entered")
+        return main_menu()
+    pending_files = import_raw_data_directory(directory, force=force)
+    if pending_files:
+        set_up_now = Menu.deploy(
+            title=f'{len(pending_files)} files had no matching account',
+            choices=[
+                ('set up their accounts now', True),
+                ('leave them for later', False)
+            ]
+        )
+        if set_up_now:
+            for filepath in pending_files:
+                import_raw_file(filepath, force)
     main_menu()
 
+
+def import_raw_data_directory(directory, force: bool = False, workers: int = None, batch_rows: int = 50000) -> list:
+    """Loads every csv in directory. Files are read, parsed and classified in a process pool, and this process is
+    the only writer: it commits the parsed files in batches of at least batch_rows rows, one transaction per batch.
+
+    :return: the filepaths that had no matching account and were left for later
+    """
+    with profiler.run(f'import folder {directory}'):
+        return _import_raw_data_directory(directory, force, workers, batch_rows)
+
+
+def _import_raw_data_directory(directory, force: bool, workers: int | None, batch_rows: int) -> list:
+    start_time = time.perf_counter()
+    unchanged, pending, failed, jobs = [], [], [], []
+    for filename in sorted(os.listdir(directory)):
+        filepath = os.path.join(directory, filename)
+        if not filename.endswith('.csv') or not os.path.isfile(filepath):
+            continue
+        with profiler.span('unchanged check'):
+            if not force and file_is_unchanged(filename, filepath):
+                unchanged.append(filename)
+                continue
+        with profiler.span('account detection'):
+            account_key = get_account_key_from_filename(filename)
+        if account_key is None:
+            pending.append(filepath)
+            continue
+        jobs.append((filepath, int(account_key)))
+
+    imported = {}
+    if jobs:
+        imported = _parse_and_write_statements(jobs, workers, batch_rows, failed)
+
+    elapsed = time.perf_counter() - start_time
+    total_rows = sum(rows for rows, _ in imported.values())
+    new_rows = sum(new for _, new in imported.values())
+    print(f'\nimported {len(imported)} files from {directory} in {elapsed:.2f}s '
+          f'({total_rows / max(elapsed, 1e-9):.0f} rows/sec)')
+    for filename, (rows, new) in sorted(imported.items()):
+        print(f'\t{filename}: {rows} rows, {new} new, {rows - new} already present')
+    print(f'{total_rows} rows read, {new_rows} new, {total_rows - new_rows} already present')
+    if unchanged:
+        print(f'{len(unchanged)} unchanged files skipped: {", ".join(unchanged)}')
+    if pending:
+        print(f'{len(pending)} files with no matching account left for later: '
+              f'{", ".join(os.path.basename(filepath) for filepath in pending)}')
+    for filename, err in failed:
+        print(f'FAILED {filename}: {err!r}')
+    return pending
+
+
+def _parse_and_write_statements(jobs: list, workers: int | None, batch_rows: int, failed: list) -> dict:
+    """parses (filepath, account_key) jobs in a process pool and writes them batch_rows rows at a time. files that
+    couldn't be parsed or written are added to failed as (filename, error) and the rest carry on.
+
+    :return: {filename: (rows, new rows)} for the files that went in
+    """
+    # everything the workers need from the database is read up front, they never open it
+    account_keys = sorted({account_key for _, account_key in jobs})
+    account_data = {account_key: get_account_data(account_key).to_dict() for account_key in account_keys}
+    account_snippets = {account_key: get_account_snippet_pairs(account_key) for account_key in account_keys}
+
+    imported = {}
+    batch = []
+    # concurrent.futures only imports its process pool (and multiprocessing) when it's asked for
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=init_ingest_worker,
+                                                initargs=(account_snippets,)) as pool:
+        futures = {pool.submit(parse_statement_file, filepath, account_data[account_key]): filepath
+                   for filepath, account_key in jobs}
+        completed = concurrent.futures.as_completed(futures)
+        while True:
+            with profiler.span('waiting on workers'):
+                future = next(completed, None)
+            if future is None:
+                break
+            try:
+                batch.append(future.result())
+            except Exception as err:
+                failed.append((os.path.basename(futures[future]), err))
+                continue
+            if sum(len(table) for _, table, _ in batch) >= batch_rows:
+                imported.update(write_parsed_statements(batch, failed))
+                batch = []
+        if batch:
+            imported.update(write_parsed_statements(batch, failed))
+    return imported
+
+
+def write_parsed_statements(parsed: list, failed: list) -> dict:
+    """the writer side of import_raw_data_directory. commits a batch of (filename, table, fingerprint) from
+    parse_statement_file in one transaction, then saves each table to processed_data. if the transaction fails none
+    of the batch goes in, and every file in it is added to failed as (filename, error). a table that can't be saved
+    to processed_data is added to failed on its own, its transactions are already in the database.
+
+    :return: {filename: (rows, new rows)} for the files whose transactions were committed
+    """
+    results = {}
+    try:
+        with DbSession(database) as conn, profiler.span('database write'):
+            with conn.transaction():
+                for filename, table, fingerprint in parsed:
+                    results[filename] = (len(table), write_transaction_table(conn, table, filename, fingerprint))
+    except Exception as err:
+        failed.extend((filename, err) for filename, _, _ in parsed)
+        return {}
+    with profiler.span('processed write'):
+        for filename, table, _ in parsed:
+            try:
+                save_columnar(table, columnar_path('processed_data', filename))
+            except Exception as err:
+                failed.append((filename, err))
+    return results
+
+
 # user interactions
 
 
 def match_unmatched_transactions():
+    # snippets added since these were imported may already cover some of them
+    reclassify_unmatched()
     # go through transactions without matched snippets
-    unmatched_transactions = get_unmatched_transactions()
-    print(unmatched_transactions.to_string())
-    first_loop = True
-    stop_iter = False
-    while not stop_iter:
-        # make sure the user wants to keep going
-        count_query = """select count(*) from transactions where snippet_key = ''"""
-        with DbSession(database) as conn:
-            num_left = int(conn.fetch_single_value(count_query))
-        if not first_loop:
-            stop_iter = Menu.deploy(
-                title=f'There are {num_left} left',
+    show_unmatched_transactions()
+    # unmatched transactions whose memos only differ in their numbers are asked about together, biggest group first
+    clusters = get_unmatched_clusters()
+    # suggests snippets for each group, from statistics over the memos kept for the length of this run
+    suggester = SnippetSuggester(database)
+    # reads ahead on a background thread while the user answers each step's prompts
+    prefetcher = UnmatchedPrefetcher(suggester)
+    try:
+        first_loop = True
+        stop_iter = False
+        while not stop_iter:
+            cluster = clusters.largest()
+            if cluster is None:
+                break
+            cluster_account_key, members = cluster
+            memos = [memo for _, memo in members]
+            prefetcher.start(likely_snippet(memos), cluster_account_key)
+            # make sure the user wants to keep going
+            if not first_loop:
+                stop_iter = Menu.deploy(
+                    title=f'There are {len(clusters)} left in {clusters.num_clusters} groups',
+                    choices=[
+                        ('keep going', False),
+                        ('go back', True)
+                    ]
+                )
+                if stop_iter:
+                    continue
+            first_loop = False
+            # the group is shown through its first transaction
+            transaction = get_transaction(members[0][0])
+            all_types = get_all_types()
+            all_vendors = get_all_vendors()
+            transaction_string = f"Date: {transaction['date']}\n" \
+                                 f"Amount: {format_cents(transaction['amount'])}\n" \
+                                 f"Memo: {transaction['memo']}\n" \
+                                 f"{describe_cluster(memos)}"
+            # type related stuff
+            transaction_type = Menu.deploy(
+                title=transaction_string + 'Choose a transaction type',
                 choices=[
-                    ('keep going', False),
-                    ('go back', True)
-                ]
+                    (trans_type,) for trans_type in all_types
+                ],
+                zero_choice=('create new transaction type',)
             )
-            if stop_iter:
-                continue
-        first_loop = False
-        top_unmatched_transaction = f"""
-            SELECT * FROM transactions
-            WHERE snippet_key = ''
-            LIMIT 1
-        """
-        with DbSession(database) as conn:
-            transaction = conn.fetch_row(top_unmatched_transaction)
-        # get the top
-        all_types = get_all_types()
-        all_vendors = get_all_vendors()
-        transaction_string = f"Date: {transaction['date']}\n" \
-                             f"Amount: {transaction['amount']}\n" \
-                             f"Memo: {transaction['memo']}\n"
-        # type related stuff
-        transaction_type = Menu.deploy(
-            title=transaction_string + 'Choose a transaction type',
-            choices=[
-                (trans_type,) for trans_type in all_types
-            ],
-            zero_choice=('create new transaction type',)
-        )
-        if transaction_type == 'create new transaction type':
-            type_key = create_new_transaction_type(transaction)
-        else:
-            type_key = get_type_key_from_id(transaction_type)
-
-        # vendor related stuff
-        vendor_id = Menu.deploy(
-            title=transaction_string + 'Choose a vendor',
-            choices=[
-                (trans_vendor,) for trans_vendor in all_vendors
-            ],
-            zero_choice=('create new vendor',)
-        )
-        if vendor_id == 'create new vendor':
-            vendor_key = create_new_vendor(transaction)
-        else:
-            vendor_key = get_vendor_key_from_id(vendor_id)
-
-        # snippet stuff
-        memo = transaction['memo']
-        account_key = transaction['account_key']
-        transaction_key = transaction['transaction_key']
-        snippet_choice = 'retry'
-        while snippet_choice == 'retry':
-            snippet = input(f'{memo}\n'
-                            f'enter the part of the above memo that identifies it\n'
-                            f'> ')
-            # show user all matching transactions in the database
-            matching_transactions = match_transactions_to_snippet(snippet)
-            print(f"transactions matching '{snippet}'")
-            print(matching_transactions.to_string())
-            snippet_choice = Menu.deploy(
-                title='with the above matches, commit the snippet to database?',
+            if transaction_type == 'create new transaction type':
+                type_key = create_new_transaction_type(transaction)
+            else:
+                type_key = get_type_key_from_id(transaction_type)
+
+            # vendor related stuff
+            vendor_id = Menu.deploy(
+                title=transaction_string + 'Choose a vendor',
                 choices=[
-                    ('yes', 1),
-                    ('retry', 2)
-                ]
+                    (trans_vendor,) for trans_vendor in all_vendors
+                ],
+                zero_choice=('create new vendor',)
             )
-        transaction_keys = f"({', '.join(str(x) for x in matching_transactions['transaction_key'].tolist())})"
-        # upload new snippet, update the transaction
-        snippet_key = add_snippet_to_db(snippet, account_key, vendor_key, type_key)
-        update_query = f"""
-            UPDATE transactions
-            SET snippet_key = {snippet_key}
-            WHERE transaction_key in {transaction_keys}
-        """
-        with DbSession('persistent_data.db') as conn:
-            conn.commit_query(update_query)
+            if vendor_id == 'create new vendor':
+                vendor_key = create_new_vendor(transaction)
+            else:
+                vendor_key = get_vendor_key_from_id(vendor_id)
+
+            # snippet stuff
+            memo = transaction['memo']
+            account_key = transaction['account_key']
+            suggestions = suggester.suggest(account_key, memos, vendor_key)
+            if suggestions:
+                # the user is likely to take the first one, its preview is read while they decide
+                prefetcher.add(suggestions[0][0])
+            snippet_choice = 'retry'
+            while snippet_choice == 'retry':
+                print(describe_suggestions(suggestions, len(memos)), end='')
+                snippet = input(f'{memo}\n'
+                                f'enter the part of the above memo that identifies it'
+                                f'{", or the number of a suggestion" if suggestions else ""}\n'
+                                f'> ')
+                if snippet.isdigit() and 1 <= int(snippet) <= len(suggestions):
+                    snippet = suggestions[int(snippet) - 1][0]
+                if snippet not in memo:
+                    # snippets match case-sensitively, so this one would leave the transaction unmatched
+                    print(f"'{snippet}' is not in the memo exactly as typed (matching is case-sensitive)")
+                    continue
+                covered = sum(snippet in cluster_memo for cluster_memo in memos)
+                if covered < len(memos):
+                    print(f"'{snippet}' is in {covered} of the group's {len(memos)} memos, the rest stay unmatched")
+                # show the user exactly the transactions the snippet will label
+                matching_transactions = prefetcher.preview(snippet)
+                if matching_transactions is None:
+                    matching_transactions = preview_snippet(snippet, account_key)
+                print(f"unmatched transactions on this account that '{snippet}' will label")
+                print(display_amounts(matching_transactions).to_string())
+                snippet_choice = Menu.deploy(
+                    title='with the above matches, commit the snippet to database?',
+                    choices=[
+                        ('yes', 1),
+                        ('retry', 2)
+                    ]
+                )
+            # upload new snippet, then label every unmatched transaction it applies to, the whole group included, in
+            # one UPDATE
+            snippet_key = add_snippet_to_db(snippet, account_key, vendor_key, type_key)
+            labelled = apply_snippet_to_unmatched(snippet_key)
+            print(f"'{snippet}' labelled {labelled} unmatched transactions")
+            for overlap in find_snippet_overlaps(account_key, snippet_key):
+                print(describe_overlap(overlap))
+            suggester.record(account_key, snippet, vendor_key)
+            clusters.retain(get_unmatched_transaction_keys())
+    finally:
+        prefetcher.shutdown()
     print('Completed all unmatched transactions')
     view_saved_data_menu()
 
 
-def get_unmatched_transactions() -> pandas.DataFrame:
+# database file -> the grouping of its unmatched transactions, kept between visits to match_unmatched_transactions
+_unmatched_clusters = {}
+
+
+def get_unmatched_clusters() -> MemoClusters:
+    """The unmatched transactions grouped by memo. The grouping is kept for the life of the program and brought up
+    to date from the unmatched transaction keys each time, so only the memos of transactions it hasn't grouped yet
+    (new imports, or ones a snippet edit let go) are read and keyed.
+    """
+    clusters = _unmatched_clusters.setdefault(os.path.abspath(database), MemoClusters())
+    unmatched = get_unmatched_transaction_keys()
+    clusters.retain(unmatched)
+    new_keys = unmatched - clusters.transaction_keys
+    if new_keys:
+        query = """
+            SELECT transaction_key, account_key, memo FROM transactions
+            WHERE transaction_key IN (SELECT value FROM json_each(?))
+        """
+        with DbSession(database) as conn:
+            clusters.add(conn.iter_query(query, (key_list(new_keys),)))
+    return clusters
+
+
+def get_unmatched_transaction_keys() -> set:
+    query = """
+        SELECT transaction_key FROM transactions
+        WHERE snippet_key = ''
+    """
+    with DbSession(database) as conn:
+        keys = conn.fetch_column(query) or []
+    return {int(key) for key in keys}
+
+
+def get_transaction(transaction_key) -> sqlite3.Row:
+    query = """
+        SELECT * FROM transactions
+        WHERE transaction_key = ?
+    """
+    with DbSession(database) as conn:
+        return conn.fetch_row(query, (int(transaction_key),))
+
+
+def describe_cluster(memos: list, sample: int = 5) -> str:
+    """a line for the prompts about how many transactions a group has, with a few of its other memos"""
+    if len(memos) == 1:
+        return ''
+    others = list(dict.fromkeys(memo for memo in memos[1:] if memo != memos[0]))
+    lines = [f'and {len(memos) - 1} more like it\n']
+    lines += [f'\t{memo}\n' for memo in others[:sample]]
+    if len(others) > sample:
+        lines.append(f'\t... {len(others) - sample} more different memos\n')
+    return ''.join(lines)
+
+
+def describe_suggestions(suggestions: list, group_size: int) -> str:
+    """the numbered list of SnippetSuggester suggestions shown before the snippet prompt"""
+    if not suggestions:
+        return ''
+    lines = ['suggested snippets:\n']
+    for number, (snippet, covered, other_unmatched) in enumerate(suggestions, 1):
+        also = f', and {other_unmatched} other unmatched' if other_unmatched else ''
+        lines.append(f"{number}: '{snippet}' is in {covered} of the group's {group_size} memos{also}\n")
+    return ''.join(lines)
+
+
+class UnmatchedPrefetcher:
+    """Reads ahead for match_unmatched_transactions on a background thread while the user is answering prompts, so
+    snippet suggestions and previews show up without waiting on the database.
+
+    Started on a group with the snippet the user will most likely pick, it loads the account's memo statistics into
+    the suggester, reads that snippet's preview and warms the types and vendors lookups. More snippets can be added
+    for the same group. The thread gets its own connection from the connection manager, and its sessions don't
+    print.
+
+    Args:
+        suggester (SnippetSuggester): the suggester whose accounts are loaded ahead of time
+    """
+
+    def __init__(self, suggester: SnippetSuggester):
+        self.suggester = suggester
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch')
+        self._previews = {}
+        self._account_key = None
+
+    def start(self, snippet, account_key):
+        self._previews = {}
+        self._account_key = account_key
+        self._executor.submit(self._warm, account_key)
+        self.add(snippet)
+
+    def add(self, snippet):
+        if snippet and snippet not in self._previews:
+            self._previews[snippet] = self._executor.submit(self._read_preview, snippet, self._account_key)
+
+    def _warm(self, account_key):
+        with quiet_sessions():
+            self.suggester.account(account_key)
+            get_all_types()
+            get_all_vendors()
+
+    @staticmethod
+    def _read_preview(snippet, account_key) -> pandas.DataFrame:
+        with quiet_sessions():
+            return preview_snippet(snippet, account_key)
+
+    def preview(self, snippet) -> pandas.DataFrame | None:
+        """the read-ahead's matches for snippet, if it was started or added. None otherwise or if reading it failed,
+        the caller reads for itself then."""
+        future = self._previews.get(snippet)
+        if future is None:
+            return None
+        try:
+            return future.result()
+        except Exception:
+            logger.warning('reading ahead failed, continuing without it', exc_info=True)
+            return None
+
+    def shutdown(self):
+        """waits for the thread to finish and closes its connection, which only that thread can do"""
+        self._executor.submit(connection_manager.close, database)
+        self._executor.shutdown(wait=True)
+
+
+def show_unmatched_transactions():
+    """pages through the transactions without a snippet. a list that fits on one page is just printed."""
     query = """
         SELECT * FROM transactions
         WHERE snippet_key = ''
     """
-    with DbSession('persistent_data.db') as conn:
-        results = conn.fetch_query(query)
-    return results
+    browse_query(query, wait=False)
 
 
-def create_new_transaction_type(transaction: pandas.Series) -> int:
+def create_new_transaction_type(transaction: sqlite3.Row) -> int:
     print(f"Date: {transaction['date']}\n"
-          f"Amount: {transaction['amount']}\n"
+          f"Amount: {format_cents(transaction['amount'])}\n"
           f"Memo: {transaction['memo']}\n")
     new_type = input('New type for above transaction?\n'
                      '> ')
-    insert_query = f"""
+    insert_query = """
         INSERT INTO types
         (type_id)
         VALUES
-            ('{new_type}')
+            (?)
     """
-    fetch_query = f"""
+    fetch_query = """
         SELECT type_key
         FROM types
-        WHERE type_id = '{new_type}'
+        WHERE type_id = ?
     """
     with DbSession('persistent_data.db') as conn:
-        conn.commit_query(insert_query)
-        type_key = conn.fetch_single_value(fetch_query)
+        conn.commit_query(insert_query, (new_type,))
+        type_key = conn.fetch_single_value(fetch_query, (new_type,))
+    get_lookup_cache(database).invalidate('types')
     return int(type_key)
 
 
-def create_new_vendor(transaction: pandas.Series) -> int:
+def create_new_vendor(transaction: sqlite3.Row) -> int:
     print(f"Date: {transaction['date']}\n"
-          f"Amount: {transaction['amount']}\n"
+          f"Amount: {format_cents(transaction['amount'])}\n"
           f"Memo: {transaction['memo']}\n")
     new_vendor = input('New vendor for above transaction?\n'
                        '> ')
@@ -541,31 +936,51 @@ def create_new_vendor(transaction: pandas.Series) -> int:
             ('no', 0)
         ]
     )
-    insert_query = f"""
+    insert_query = """
         INSERT INTO vendors
         (vendor_id, is_internal_account)
         VALUES
-            ('{new_vendor}', {is_internal_account})
+            (?, ?)
     """
-    fetch_query = f"""
+    fetch_query = """
         SELECT vendor_key
         FROM vendors
-        WHERE vendor_id = '{new_vendor}'
+        WHERE vendor_id = ?
     """
     with DbSession('persistent_data.db') as conn:
-        conn.commit_query(insert_query)
-        type_key = conn.fetch_single_value(fetch_query)
+        conn.commit_query(insert_query, (new_vendor, is_internal_account))
+        type_key = conn.fetch_single_value(fetch_query, (new_vendor,))
+    get_lookup_cache(database).invalidate('vendors')
     return int(type_key)
 
 
-def match_transactions_to_snippet(snippet) -> pandas.DataFrame:
-    query = f"""
-        SELECT * FROM transactions
-        WHERE memo LIKE '%{snippet}%'
-    """
-    with DbSession('persistent_data.db') as conn:
-        transactions = conn.fetch_query(query)
-    return transactions
+def preview_snippet(snippet, account_key) -> pandas.DataFrame:
+    """the transactions a new snippet would label: exactly the ones apply_snippet_to_unmatched updates once it's
+    committed, so what the user is asked to confirm is what gets written"""
+    with DbSession(database) as conn:
+        query = f"""
+            SELECT * FROM transactions
+            WHERE
+                snippet_key = '' AND
+                account_key = :account_key AND
+                instr(memo, :snippet) > 0
+                {snippet_memo_filter(conn, ':snippet')}
+            ORDER BY transaction_key
+        """
+        return conn.fetch_query(query, {'snippet': snippet, 'account_key': int(account_key)})
+
+
+def snippet_memo_filter(conn: DbSession, snippet_sql) -> str:
+    """an `AND transaction_key IN (...)` narrowing a query on transactions to the memos the memo index says contain
+    snippet_sql (sql giving the snippet's text), or nothing if the database doesn't have the index. glob is
+    case-sensitive like instr, and its wildcard characters are escaped by wrapping them in brackets."""
+    if 'transactions_memo_fts' not in conn.tables:
+        return ''
+    glob_text = f"replace(replace(replace({snippet_sql}, '[', '[[]'), '*', '[*]'), '?', '[?]')"
+    return f"""AND transaction_key IN (
+                SELECT rowid FROM transactions_memo_fts
+                WHERE memo GLOB '*' || {glob_text} || '*'
+            )"""
 
 
 def check_db_tables():
@@ -583,34 +998,51 @@ def check_db_tables():
     query = f"""
         SELECT * FROM {selected_table}
     """
-    with DbSession('persistent_data.db') as conn:
-        table_data = conn.fetch_query(query)
-    print(table_data.to_string())
-    input('press enter to continue')
+    browse_query(query)
     check_db_tables()
 
 
 def db_browser():
+    max_rows = MAX_ROWS
     with sqlite3.connect('persistent_data.db') as conn:
         user_input = ''
         while user_input.upper() != 'EXIT':
             user_input = input('\n\nnew query:\n')
+            words = user_input.split()
+            if len(words) == 2 and words[0].upper() == 'ROWS' and (words[1].isdigit() or words[1].upper() == 'ALL'):
+                # changes how many rows of a result are read at most
+                max_rows = None if words[1].upper() == 'ALL' else int(words[1])
+                print(f'showing {"all rows" if max_rows is None else f"up to {max_rows} rows"} of each result')
+                continue
             if user_input.upper() not in ('', 'EXIT', 'COMMIT'):
+                cursor = conn.cursor()
                 try:
-                    results = pandas.read_sql_query(user_input, conn)
-                    print(results.to_string())
-                except TypeError as err:
-                    print(f"WARNING: '{err}' thrown, ignore if you entered an update query")
-                except pandas.errors.DatabaseError as err:
+                    start = time.perf_counter()
+                    cursor.execute(user_input)
+                    print(f'ran in {1000 * (time.perf_counter() - start):.1f}ms')
+                    if cursor.description is None:  # an update or some other statement without results
+                        print(f'{max(cursor.rowcount, 0)} rows changed')
+                    else:
+                        pager = Pager.from_cursor(cursor, max_rows=max_rows)
+                        browse(pager, wait=False, show_time=True)
+                        if pager.truncated:
+                            print("enter 'ROWS <number>' or 'ROWS ALL' to change the limit")
+                except sqlite3.Error as err:
                     print(f"WARNING: '{err}' thrown")
+                finally:
+                    cursor.close()
             if user_input.upper() == 'COMMIT':
                 conn.commit()
+                # the writes went around the write helpers, so the cached lookups may be stale
+                get_lookup_cache(database).invalidate()
+    # leaving the with block commits whatever is left
+    get_lookup_cache(database).invalidate()
     view_saved_data_menu()
 
 
-def open_processed_csv():
-    os.chdir('processed_data')
-    processed_files = os.listdir()
+def open_processed_data():
+    # names starting with a dot are tables still being written
+    processed_files = sorted(name for name in os.listdir('processed_data') if not name.startswith('.'))
     if len(processed_files) == 0:
         print('no saved files yet')
         main_menu()
@@ -621,14 +1053,30 @@ def open_processed_csv():
         zero_choice=('Back',)
     )
     if file == 'Back':
-        os.chdir('..')
         view_saved_data_menu()
-    else:
-        data = pandas.read_csv(file)
-        print(data.to_string())
-        input('press enter to go back')
-        os.chdir('..')
+        return
+    filepath = os.path.join('processed_data', file)
+    if not is_columnar(filepath):  # saved as csv by an older version
+        columns = pandas.read_csv(filepath, nrows=0).columns
+        with pandas.read_csv(filepath, chunksize=VIEW_CHUNK_ROWS) as chunks:
+            browse(Pager(FrameChunks(chunks), columns, formatters=DISPLAY_FORMATTERS))
+    elif Menu.deploy(title=file, choices=[('view', False), ('export to csv', True)]):
+        csv_filepath = filepath[:-len(COLUMNAR_SUFFIX)] + '.csv'
+        columnar_to_csv(filepath, csv_filepath)
+        print(f'saved {csv_filepath}')
         view_saved_data_menu()
+        return
+    else:
+        # only the columns being shown get mapped in, and only the rows of the pages looked at get read
+        columns = ['Date', 'Memo', 'Amount']
+        chunks = (formatted_dates(chunk) for chunk in iter_columnar(filepath, columns, VIEW_CHUNK_ROWS))
+        browse(Pager(FrameChunks(chunks), columns, formatters=DISPLAY_FORMATTERS))
+    view_saved_data_menu()
+
+
+def formatted_dates(table: pandas.DataFrame) -> pandas.DataFrame:
+    table['Date'] = table['Date'].dt.strftime(DATE_FORMAT) if table['Date'].dtype.kind == 'M' else table['Date']
+    return table
 
 
 def create_new_account(filename, sample_data: pandas.DataFrame) -> str:
@@ -687,13 +1135,7 @@ def get_account_key_from_prompt(filename, data) -> int:
     if account_id == 'create new account':
         account_id = create_new_account(filename, data)
     # get the account key from that account id and return it
-    query = f"""
-        SELECT account_key
-        FROM accounts
-        WHERE account_id = '{account_id}'
-    """
-    with DbSession('persistent_data.db') as conn:
-        return int(conn.fetch_single_value(query))
+    return get_account_key_from_id(account_id)
 
 
 def get_vendor_key_for_account(account_id) -> int:
@@ -714,13 +1156,7 @@ def get_vendor_key_for_account(account_id) -> int:
         vendor_id = account_id
         transfer_key = get_type_key_from_id('Transfer')
         add_vendor_to_db(vendor_id, is_internal_account=True, typical_type_key=transfer_key)
-    query = f"""
-        SELECT vendor_key
-        FROM vendors
-        WHERE vendor_id = '{vendor_id}'
-    """
-    with DbSession('persistent_data.db') as conn:
-        return int(conn.fetch_single_value(query))
+    return get_vendor_key_from_id(vendor_id)
 
 
 # DB interactions
@@ -732,49 +1168,20 @@ def get_account_key_from_filename(filename):
     :param filename: The filename to search for.
     :return: The source account key for the matching account, or None if no match is found.
     """
-    # get the snippets from database for matching accounts to filenames
-    filename_snippets = get_filename_snippets()
-    if filename_snippets.empty:  # return none if the snippets table is empty
-        return None
-    for ind, row in filename_snippets.iterrows():
-        snippet = row['snippet']
-        if snippet in filename:
-            return row['source_account_key']
-    else:
-        return None
+    # the filename snippets, first one in table order wins
+    return get_lookup_cache(database).filename_matcher().match(filename)
 
 
 def get_account_key_from_id(account_id):
-    query = f"""
-        SELECT account_key
-        FROM accounts
-        WHERE account_id = `{account_id}`
-    """
-    with DbSession('persistent_data.db') as conn:
-        account_key = conn.fetch_single_value(query)
-    return account_key
+    return get_lookup_cache(database).account_keys().get(account_id)
 
 
 def get_type_key_from_id(type_id) -> int:
-    query = f"""
-        SELECT type_key
-        FROM types
-        WHERE type_id = '{type_id}'
-    """
-    with DbSession('persistent_data.db') as conn:
-        type_key = conn.fetch_single_value(query)
-    return int(type_key)
+    return get_lookup_cache(database).type_keys()[type_id]
 
 
 def get_vendor_key_from_id(vendor_id) -> int:
-    query = f"""
-        SELECT vendor_key
-        FROM vendors
-        WHERE vendor_id = '{vendor_id}'
-    """
-    with DbSession('persistent_data.db') as conn:
-        vendor_key = conn.fetch_single_value(query)
-    return int(vendor_key)
+    return get_lookup_cache(database).vendor_keys()[vendor_id]
 
 
 def get_all_tables() -> list:
@@ -790,53 +1197,259 @@ def get_all_tables() -> list:
 
 
 def get_all_accounts() -> list:
-    query = """
-        SELECT account_id
-        FROM accounts
-    """
-    with DbSession('persistent_data.db') as conn:
-        accounts = conn.fetch_column(query)
-    return accounts
+    return list(get_lookup_cache(database).account_ids())
 
 
 def get_all_vendors() -> list:
-    query = """
-        SELECT vendor_id
-        FROM vendors
-    """
-    with DbSession('persistent_data.db') as conn:
-        vendors = conn.fetch_column(query)
-    return vendors
+    return list(get_lookup_cache(database).vendor_ids())
 
 
 def get_all_types() -> list:
-    query = """
-        SELECT type_id
-        FROM types
-    """
-    with DbSession('persistent_data.db') as conn:
-        vendors = conn.fetch_column(query)
-    return vendors
+    return list(get_lookup_cache(database).type_ids())
 
 
 def get_matching_snippets(selected_filename) -> pandas.DataFrame:
     source_account_key = get_account_key_from_filename(selected_filename)
-    query = f"""
+    query = """
         SELECT * from snippets
-        WHERE source_account_key = {source_account_key}
+        WHERE source_account_key = ?
+    """
+    with DbSession(database) as conn:
+        return conn.fetch_query(query, (source_account_key,))
+
+
+def get_account_snippet_pairs(account_key) -> list:
+    """(snippet, snippet_key) for every snippet on an account, in table order, ready for a SnippetMatcher"""
+    return get_lookup_cache(database).account_snippet_pairs(account_key)
+
+
+def find_snippet_overlaps(account_key, snippet_key=None) -> list:
+    """snippet_overlaps for an account's snippets over its transactions. given a snippet_key, only that snippet's pairs,
+    from just the memos that contain it, which keeps it quick enough to run after every new snippet.
+
+    :return: snippet_overlaps' dicts, with snippet_keys as the values
+    """
+    snippet_pairs = get_account_snippet_pairs(account_key)
+    memos_query = """
+        SELECT memo, count(*) AS transactions
+        FROM transactions
+        WHERE account_key = :account_key
+        GROUP BY memo
+    """
+    params = {'account_key': int(account_key)}
+    with DbSession(database) as conn:
+        if snippet_key is not None:
+            snippet_text = "(SELECT snippet FROM snippets WHERE snippet_key = :snippet_key)"
+            memos_query = f"""
+                SELECT memo, count(*) AS transactions
+                FROM transactions
+                WHERE
+                    account_key = :account_key AND
+                    instr(memo, {snippet_text}) > 0
+                    {snippet_memo_filter(conn, snippet_text)}
+                GROUP BY memo
+            """
+            params['snippet_key'] = int(snippet_key)
+        memos = dict(conn.iter_query(memos_query, params))
+        overlaps = snippet_overlaps(snippet_pairs, memos, involving=None if snippet_key is None else int(snippet_key))
+        if snippet_key is not None:
+            # only the new snippet's memos were counted, the other side of each pair is counted over all of them
+            hits_query = """
+                SELECT count(*) FROM transactions
+                WHERE account_key = ? AND instr(memo, ?) > 0
+            """
+            for overlap in overlaps:
+                side = 'first' if overlap['second'] == int(snippet_key) else 'second'
+                if overlap['relation'] != 'duplicate':
+                    overlap[f'{side}_hits'] = int(conn.fetch_single_value(
+                        hits_query, (int(account_key), overlap[f'{side}_snippet'])))
+    return overlaps
+
+
+def describe_overlap(overlap: dict) -> str:
+    """one line about a pair from find_snippet_overlaps, saying which snippet gets the transactions they share"""
+    first, second = f"'{overlap['first_snippet']}'", f"'{overlap['second_snippet']}'"
+    relation = overlap['relation']
+    if relation == 'duplicate':
+        return (f"{second} is a repeat of {first}, which comes first and gets all {overlap['shared']} of their "
+                f"transactions")
+    if relation == 'first in second':
+        return (f"{second} contains {first}, which comes first, so all {overlap['second_hits']} transactions with "
+                f"{second} go to {first}")
+    if relation == 'second in first':
+        return (f"{first} contains {second} and comes first, so it gets {overlap['shared']} of the "
+                f"{overlap['second_hits']} transactions with {second}")
+    return (f"{first} and {second} are both in {overlap['shared']} transactions' memos, which go to {first} since it "
+            f"comes first ({overlap['first_hits']} and {overlap['second_hits']} transactions in all)")
+
+
+def snippet_overlap_report():
+    """prints the overlapping snippets of every account, the ones that take transactions away from others first"""
+    for account_id in get_all_accounts():
+        account_key = get_account_key_from_id(account_id)
+        overlaps = find_snippet_overlaps(account_key)
+        print(f'\n{account_id}: {len(overlaps)} overlapping snippet pairs')
+        for overlap in overlaps:
+            print(f'\t{describe_overlap(overlap)}')
+    input('press enter to go back')
+    view_saved_data_menu()
+
+
+def apply_snippet_to_unmatched(snippet_key) -> int:
+    """Labels every unmatched transaction on the snippet's account whose memo contains the snippet, in one UPDATE.
+    Matching is case-sensitive, the same as the ingest classifier. The unmatched rows come off the snippet_key index
+    and, when the database has it, the memo index narrows them down by the snippet text first.
+
+    :return: the number of transactions labelled
+    """
+    snippet_text = "(SELECT snippet FROM snippets WHERE snippet_key = :snippet_key)"
+    with DbSession(database) as conn:
+        query = f"""
+            UPDATE transactions
+            SET snippet_key = :snippet_key
+            WHERE
+                snippet_key = '' AND
+                account_key = (SELECT source_account_key FROM snippets WHERE snippet_key = :snippet_key) AND
+                instr(memo, {snippet_text}) > 0
+                {snippet_memo_filter(conn, snippet_text)}
+        """
+        return conn.commit_query(query, {'snippet_key': int(snippet_key)})
+
+
+def edit_snippet(snippet_key, new_snippet) -> int:
+    """Changes a snippet's text and relabels what that affects. The transactions on its account that it labelled, or
+    whose memos contain the new text, go back through the account's snippets with the ingest's first-match-in-table-
+    order rule, and the ones whose winner changed are updated. That covers rows the old text labelled that no longer
+    match, unmatched rows the new text matches, and rows a later snippet labelled that the edited one now wins.
+
+    :return: the number of transactions whose label changed
+    """
+    snippet_key = int(snippet_key)
+    affected_query = """
+        SELECT transaction_key, memo, snippet_key
+        FROM transactions
+        WHERE
+            account_key = :account_key AND
+            (snippet_key = :snippet_key OR instr(memo, :snippet) > 0)
+    """
+    try:
+        with DbSession(database) as conn, conn.transaction():
+            account_key = conn.fetch_single_value("""
+                SELECT source_account_key
+                FROM snippets
+                WHERE snippet_key = ?
+            """, (snippet_key,))
+            conn.commit_query("""
+                UPDATE snippets
+                SET snippet = ?
+                WHERE snippet_key = ?
+            """, (new_snippet, snippet_key))
+            # the lookups read through this connection, so they see the new text before it's committed
+            get_lookup_cache(database).invalidate('snippets')
+            matcher = SnippetMatcher(get_account_snippet_pairs(account_key))
+            params = {'account_key': int(account_key), 'snippet_key': snippet_key, 'snippet': new_snippet}
+            changes = []
+            for transaction_key, memo, current in list(conn.iter_query(affected_query, params)):
+                winner = matcher.match(str(memo))
+                winner = '' if winner is None else int(winner)
+                if str(winner) != str(current):
+                    changes.append((winner, int(transaction_key)))
+            if changes:
+                conn.commit_many("UPDATE transactions SET snippet_key = ? WHERE transaction_key = ?", changes)
+    finally:
+        # the cache may have been loaded with the new text before a rollback
+        get_lookup_cache(database).invalidate('snippets')
+    return len(changes)
+
+
+def edit_snippet_menu():
+    """picks an account and one of its snippets, and changes the snippet's text with edit_snippet"""
+    if not get_all_accounts():
+        print('there are no accounts yet')
+        view_saved_data_menu()
+        return
+    account_id = Menu.deploy(
+        title='Choose the account of the snippet to edit',
+        choices=[(account_id,) for account_id in get_all_accounts()],
+        zero_choice=('go back',)
+    )
+    if account_id == 'go back':
+        view_saved_data_menu()
+        return
+    account_key = get_account_key_from_id(account_id)
+    if not get_account_snippet_pairs(account_key):
+        print(f'{account_id} has no snippets')
+        edit_snippet_menu()
+        return
+    snippet_key = Menu.deploy(
+        title=f'Choose a snippet of {account_id} to edit',
+        choices=[(f"'{snippet}'", snippet_key) for snippet, snippet_key in get_account_snippet_pairs(account_key)],
+        zero_choice=('go back', None)
+    )
+    if snippet_key is None:
+        edit_snippet_menu()
+        return
+    new_snippet = input('enter the new text for the snippet, or just press enter to leave it as it is\n'
+                        '> ')
+    if new_snippet:
+        changed = edit_snippet(snippet_key, new_snippet)
+        print(f"'{new_snippet}' saved, {changed} transactions relabelled")
+        for overlap in find_snippet_overlaps(account_key, snippet_key):
+            print(describe_overlap(overlap))
+    edit_snippet_menu()
+
+
+def reclassify_unmatched(account_key=None, transaction_keys=None) -> int:
+    """Runs unmatched transactions past their account's snippets with the same first-match-in-table-order rule the
+    ingest uses, so snippets added after a file was imported still get applied to it. Only unmatched rows are read
+    (optionally just one account's, or just the given transaction_keys) and all the labels go out in one executemany.
+
+    :return: the number of transactions labelled
     """
-    with DbSession('persisten_data.db') as conn:
-        return conn.fetch_query(query)
+    filters, params = ["snippet_key = ''"], []
+    if account_key is not None:
+        filters.append('account_key = ?')
+        params.append(int(account_key))
+    if transaction_keys is not None:
+        if not transaction_keys:
+            return 0
+        filters.append('transaction_key IN (SELECT value FROM json_each(?))')
+        params.append(key_list(transaction_keys))
+    unmatched_query = f"""
+        SELECT transaction_key, account_key, memo
+        FROM transactions
+        WHERE {' AND '.join(filters)}
+    """
+    with DbSession(database) as conn:
+        by_account = {}
+        for transaction_key, unmatched_account_key, memo in conn.iter_query(unmatched_query, params):
+            by_account.setdefault(unmatched_account_key, []).append((transaction_key, memo))
+        updates = []
+        for unmatched_account_key, account_rows in sorted(by_account.items()):
+            matcher = SnippetMatcher(get_account_snippet_pairs(unmatched_account_key))
+            for transaction_key, memo in account_rows:
+                snippet_key = matcher.match(str(memo))
+                if snippet_key is not None:
+                    updates.append((int(snippet_key), int(transaction_key)))
+        if updates:
+            conn.commit_many("UPDATE transactions SET snippet_key = ? WHERE transaction_key = ?", updates)
+    return len(updates)
+
+
+def key_list(keys) -> str:
+    """a list of keys as one parameter, for `IN (SELECT value FROM json_each(?))`. unlike a list of ? placeholders
+    the statement text stays the same whatever the number of keys, so it's prepared once."""
+    return json.dumps([int(key) for key in keys])
 
 
 def get_filename_key(filename) -> int | None:
-    query = f"""
+    query = """
         SELECT filename_key 
         FROM filenames
-        WHERE filename_id = '{filename}'
+        WHERE filename_id = ?
     """
     with DbSession('persistent_data.db') as conn:
-        results = conn.fetch_single_value(query)
+        results = conn.fetch_single_value(query, (filename,))
     if results is None:
         return None
     return int(results)
@@ -846,123 +1459,147 @@ def purge_filename_transactions(filename):
     filename_key = get_filename_key(filename)
     if filename_key is None:
         return None
-    count_query = f"""
+    count_query = """
         SELECT count(*)
         FROM transactions 
-        WHERE filename_key = {filename_key}
+        WHERE filename_key = ?
     """
-    delete_query = f"""
+    delete_query = """
         DELETE FROM transactions
-        WHERE filename_key = {filename_key}
+        WHERE filename_key = ?
     """
     with DbSession('persistent_data.db') as conn:
-        count = conn.fetch_single_value(count_query)
-        conn.commit_query(delete_query)
+        count = conn.fetch_single_value(count_query, (filename_key,))
+        conn.commit_query(delete_query, (filename_key,))
     return count
 
 
 def get_filename_snippets() -> pandas.DataFrame:
-    query = """
-        SELECT 
-            snippet_key,
-            snippet,
-            source_account_key
-        FROM 
-            snippets
-        WHERE
-            type_key IS NULL AND
-            vendor_key IS NULL
-    """
-    with DbSession('persistent_data.db') as conn:
-        return conn.fetch_query(query)
+    return get_lookup_cache(database).filename_snippets()
 
 
 def get_account_data(account_key: str) -> pandas.Series:
-    query = f"""
-        SELECT * FROM accounts
-        WHERE account_key = {account_key}
-    """
-    with DbSession('persistent_data.db') as conn:
-        account_data = conn.fetch_query(query)
-    return account_data.iloc[0]
+    return get_lookup_cache(database).account_row(account_key)
 
 
 def add_vendor_to_db(vendor_id, is_internal_account: bool = False, typical_type_key=None):
-    insert_query = f"""
+    insert_query = """
         INSERT INTO vendors
         (vendor_id, is_internal_account, typical_type_key)
         VALUES
-            ('{vendor_id}', {int(is_internal_account)}, {typical_type_key})
+            (?, ?, ?)
     """
-    fetch_query = f"""
+    fetch_query = """
         SELECT vendor_key
         FROM vendors
-        WHERE vendor_id = '{vendor_id}'
+        WHERE vendor_id = ?
     """
     with DbSession('persistent_data.db') as conn:
-        conn.commit_query(insert_query)
-        return conn.fetch_single_value(fetch_query)
+        conn.commit_query(insert_query, (vendor_id, int(is_internal_account), typical_type_key))
+        vendor_key = conn.fetch_single_value(fetch_query, (vendor_id,))
+    get_lookup_cache(database).invalidate('vendors')
+    return vendor_key
 
 
 def add_account_to_db(account_id, date_column, memo_column, amount_column, parsing_protocol, vendor_key, flip_amount):
-    insert_query = f"""
+    insert_query = """
         INSERT INTO accounts
         (account_id, date_column, memo_column, amount_column, parsing_protocol, vendor_key, flip_amount)
         VALUES
-            ('{account_id}', '{date_column}', '{memo_column}', '{amount_column}', {parsing_protocol}, {vendor_key}, {flip_amount})
+            (?, ?, ?, ?, ?, ?, ?)
     """
-    fetch_query = f"""
+    fetch_query = """
         SELECT account_key
         FROM accounts
-        WHERE account_id = '{account_id}'
+        WHERE account_id = ?
     """
     with DbSession('persistent_data.db') as conn:
-        conn.commit_query(insert_query)
-        return int(conn.fetch_single_value(fetch_query))
+        conn.commit_query(insert_query, (account_id, date_column, memo_column, amount_column, parsing_protocol,
+                                         vendor_key, flip_amount))
+        account_key = int(conn.fetch_single_value(fetch_query, (account_id,)))
+    get_lookup_cache(database).invalidate('accounts')
+    return account_key
 
 
 def add_snippet_to_db(snippet, source_account_key, vendor_key=None, type_key=None):
-    vendor_key = 'NULL' if vendor_key is None else vendor_key
-    type_key = 'NULL' if type_key is None else type_key
-    insert_query = f"""
+    insert_query = """
         INSERT INTO snippets
         (snippet, source_account_key, vendor_key, type_key)
         VALUES
-            ('{snippet}', {source_account_key}, {vendor_key}, {type_key})
+            (?, ?, ?, ?)
     """
-    fetch_query = f"""
+    fetch_query = """
         SELECT snippet_key
         FROM snippets
         WHERE 
-            snippet = '{snippet}' and
-            source_account_key = '{source_account_key}'
+            snippet = ? and
+            source_account_key = ?
     """
     with DbSession('persistent_data.db') as conn:
-        conn.commit_query(insert_query)
-        snippet_key = conn.fetch_single_value(fetch_query)
+        conn.commit_query(insert_query, (snippet, source_account_key, vendor_key, type_key))
+        snippet_key = conn.fetch_single_value(fetch_query, (snippet, source_account_key))
+    get_lookup_cache(database).invalidate('snippets')
     return snippet_key
 
 
 def add_filename_to_db(filename):
     date = int(time.time())
-    insert_query = f"""
+    insert_query = """
         INSERT INTO filenames
             (filename_id, date_uploaded)
         VALUES
-            ('{filename}', {date})
+            (?, ?)
     """
-    fetch_query = f"""
+    fetch_query = """
         SELECT filename_key 
         FROM filenames
-        WHERE filename_id = '{filename}'
+        WHERE filename_id = ?
     """
     with DbSession('persistent_data.db') as conn:
-        conn.commit_query(insert_query)
-        filename_key = conn.fetch_single_value(fetch_query)
+        conn.commit_query(insert_query, (filename, date))
+        filename_key = conn.fetch_single_value(fetch_query, (filename,))
     return filename_key
 
 
-def add_new_transaction_data_to_database(account_data, data, filename):
+def get_file_fingerprint(filename) -> sqlite3.Row | None:
+    query = """
+        SELECT file_size, file_mtime, file_hash
+        FROM filenames
+        WHERE filename_id = ?
+    """
+    with DbSession(database) as conn:
+        return conn.fetch_row(query, (filename,))
+
+
+def file_is_unchanged(filename, filepath) -> bool:
+    """True if filename was imported before and filepath has the same contents it had then. size and mtime
+    matching is taken as unchanged without reading the file, otherwise the contents are hashed and compared."""
+    stored = get_file_fingerprint(filename)
+    if stored is None or stored['file_hash'] is None:
+        return False
+    stat = os.stat(filepath)
+    if stat.st_size != stored['file_size']:
+        return False
+    if stat.st_mtime == stored['file_mtime']:
+        return True
+    return file_fingerprint(filepath)['file_hash'] == stored['file_hash']
+
+
+def record_file_fingerprint(conn: DbSession, filename_key, fingerprint: dict):
+    query = """
+        UPDATE filenames
+        SET
+            file_size = :file_size,
+            file_mtime = :file_mtime,
+            file_hash = :file_hash
+        WHERE filename_key = :filename_key
+    """
+    conn.commit_query(query, {**fingerprint, 'filename_key': int(filename_key)})
+
+
+def add_new_transaction_data_to_database(account_data, data, filename, bulk: bool = True, fingerprint: dict = None):
+    if bulk:
+        return bulk_add_new_transaction_data_to_database(account_data, data, filename, fingerprint)
     # DB: get the associated account_key from the filename, and the data from that
     account_key = account_data['account_key']
     data['account_key'] = account_key
@@ -974,15 +1611,16 @@ def add_new_transaction_data_to_database(account_data, data, filename):
     else:
         filename_key = add_filename_to_db(filename)
     data['filename_key'] = filename_key
+    add_content_hashes(data)
     headers_string = ', '.join(data.columns.tolist())
 
     # DB: queries the database for matching values in snippets to classify them
-    query = f"""
+    query = """
         SELECT * from snippets
-        WHERE source_account_key = {account_key}
+        WHERE source_account_key = ?
     """
     with DbSession('persistent_data.db') as conn:
-        matching_snippets = conn.fetch_query(query)
+        matching_snippets = conn.fetch_query(query, (int(account_key),))
         logging.debug(f'query successful, {len(matching_snippets)} rows returned')
 
     # PROCESSING: new rows: snippet, vendor, type
@@ -994,20 +1632,18 @@ def add_new_transaction_data_to_database(account_data, data, filename):
         else:
             match_key = ''
         row['snippet_key'] = match_key
-        values_list = []
-        for value in row.tolist():
-            new_value = str(value).replace("'", '')
-            values_list.append(new_value)
-        values_string = ', '.join([f'{x}' if str(x).lstrip('-').isnumeric() else f"'{x}'" for x in values_list])
         # DB: upload the data to the database
         query = f"""
-            INSERT INTO transactions
+            INSERT OR IGNORE INTO transactions
                 ({headers_string})
             VALUES
-                ({values_string})
+                ({', '.join('?' * len(row))})
         """
         with DbSession('persistent_data.db') as conn:
-            conn.commit_query(query)
+            conn.commit_query(query, transaction_row_values(row))
+    if fingerprint is not None:
+        with DbSession(database) as conn:
+            record_file_fingerprint(conn, filename_key, fingerprint)
     # DB: get the view for the combined information
     # UX: print the results for user inspection
     # UX: prompt user to update unknowns (if applicable), update rows, or just upload to database
@@ -1024,59 +1660,246 @@ def add_new_transaction_data_to_database(account_data, data, filename):
     # DB: upload to the database
 
 
+def bulk_add_new_transaction_data_to_database(account_data, data, filename, fingerprint: dict = None) -> int:
+    """Bulk version of add_new_transaction_data_to_database. Classifies every row up front, then does the purge,
+    the filename insert and all the transaction inserts on one connection inside a single transaction, so a failure
+    partway through leaves the database as it was. Rows whose content hash is already in the database (from another
+    file) are skipped. If a file fingerprint is given it's stored on the filename row in the same transaction.
+
+    :return: the number of new transactions inserted
+    """
+    start_time = time.perf_counter()
+    account_key = account_data['account_key']
+    snippets_query = """
+        SELECT * from snippets
+        WHERE source_account_key = ?
+    """
+    with DbSession(database) as conn:
+        with profiler.span('classify'):
+            matching_snippets = conn.fetch_query(snippets_query, (int(account_key),))
+            logging.debug(f'query successful, {len(matching_snippets)} rows returned')
+            # PROCESSING: one automaton for the account's snippets, first matching snippet in table order wins
+            matcher = SnippetMatcher(zip(matching_snippets['snippet'], matching_snippets['snippet_key']))
+            prepare_transaction_table(data, account_key, matcher)
+        with profiler.span('database write'), conn.transaction():
+            new_rows = write_transaction_table(conn, data, filename, fingerprint)
+    elapsed = time.perf_counter() - start_time
+    print(f'inserted {new_rows} new rows from {filename}, {len(data) - new_rows} were already present '
+          f'({elapsed:.3f}s, {len(data) / max(elapsed, 1e-9):.0f} rows/sec)')
+    return new_rows
+
+
+def write_transaction_table(conn: DbSession, data: pandas.DataFrame, filename, fingerprint: dict = None) -> int:
+    """Replaces filename's transactions with the rows of a prepared table. Has to be called inside
+    conn.transaction(), so the caller decides how much goes into one commit.
+
+    :return: the number of new transactions inserted
+    """
+    filename_key = start_filename_import(conn, filename)
+    new_rows = insert_transaction_rows(conn, data, filename_key)
+    if fingerprint is not None:
+        record_file_fingerprint(conn, filename_key, fingerprint)
+    return new_rows
+
+
+def start_filename_import(conn: DbSession, filename) -> int:
+    """purges filename's old transactions if it was imported before, or adds it to filenames if it wasn't.
+
+    :return: the filename_key
+    """
+    filename_query = """
+        SELECT filename_key
+        FROM filenames
+        WHERE filename_id = ?
+    """
+    filename_key = conn.fetch_single_value(filename_query, (filename,))
+    if filename_key:
+        conn.commit_query("""
+            DELETE FROM transactions
+            WHERE filename_key = ?
+        """, (int(filename_key),))
+    else:
+        conn.commit_query("""
+            INSERT INTO filenames
+                (filename_id, date_uploaded)
+            VALUES
+                (?, ?)
+        """, (filename, int(time.time())))
+        filename_key = conn.fetch_single_value(filename_query, (filename,))
+    return int(filename_key)
+
+
+def transaction_row_values(row) -> list:
+    """the values of one prepared transaction row, ready to bind. they go in as text and the column affinities turn
+    them into what's stored, so both insert paths store the same thing. missing amounts go in as NULL."""
+    return [None if value is pandas.NA else str(value) for value in row]
+
+
+def insert_transaction_rows(conn: DbSession, data: pandas.DataFrame, filename_key: int) -> int:
+    """inserts the rows of a prepared table, skipping any whose content hash is already in the database.
+
+    :return: the number of new transactions inserted
+    """
+    data['filename_key'] = filename_key
+    rows = [transaction_row_values(row) for row in data.itertuples(index=False)]
+    insert_query = f"""
+        INSERT OR IGNORE INTO transactions
+            ({', '.join(data.columns.tolist())})
+        VALUES
+            ({', '.join('?' * len(data.columns))})
+    """
+    return conn.commit_many(insert_query, rows)
+
+
 # processing functions
 
 
-def make_table(account_data: pandas.Series, raw_data: pandas.DataFrame, filename) -> pandas.DataFrame:
+# snippet matchers for each account, built once in every worker process of import_raw_data_directory
+_worker_matchers = {}
+
+
+def init_ingest_worker(account_snippets: dict):
+    _worker_matchers.clear()
+    for account_key, snippet_pairs in account_snippets.items():
+        _worker_matchers[account_key] = SnippetMatcher(snippet_pairs)
+
+
+def parse_statement_file(filepath, account_data: dict) -> tuple:
+    """the worker side of import_raw_data_directory. copies the file into raw_data, parses and classifies it, and
+    hands back (filename, table, fingerprint) for the writer. doesn't touch the database."""
+    filename = os.path.basename(filepath)
+    fingerprint = file_fingerprint(filepath)
+    shutil.copyfile(filepath, os.path.join('raw_data', filename))
+    table = make_table(account_data, filepath)
+    account_key = account_data['account_key']
+    return filename, prepare_transaction_table(table, account_key, _worker_matchers[account_key]), fingerprint
+
+
+def display_amount(value) -> str:
+    """an amount in a paged table. integers are cents and shown in dollars, the same as display_amounts does."""
+    if isinstance(value, numbers.Integral) and not isinstance(value, bool):  # numpy's integers included
+        return format_cents(value)
+    return str(value)
+
+
+# how paged tables show their columns, by lower case column name
+DISPLAY_FORMATTERS = {'amount': display_amount}
+
+
+def browse_query(query, params=None, wait: bool = True):
+    """pages through a query's results, reading them from the database a page at a time"""
+    with DbSession(database) as conn:
+        cursor = conn.open_cursor(query, params)
+        try:
+            browse(Pager.from_cursor(cursor, formatters=DISPLAY_FORMATTERS), wait)
+        finally:
+            cursor.close()
+
+
+def display_amounts(table: pandas.DataFrame) -> pandas.DataFrame:
+    """a copy of a table for printing, with amount columns (stored as integer cents) shown in dollars"""
+    table = table.copy()
+    for column in table.columns:
+        if str(column).lower() == 'amount' and pandas.api.types.is_integer_dtype(table[column]):
+            table[column] = table[column] / 100
+    return table
+
+
+def prepare_transaction_table(data: pandas.DataFrame, account_key, matcher: SnippetMatcher,
+                              occurrences: OccurrenceCounts = None) -> pandas.DataFrame:
+    """adds the account, matched snippet and content hash columns to a table coming out of make_table. occurrences
+    is passed through to add_content_hashes when a file is being prepared a chunk at a time."""
+    data['account_key'] = account_key
+    data['snippet_key'] = matcher.match_all(data['Memo'], default='')
+    add_content_hashes(data, occurrences)
+    return data
+
+
+def make_table(account_data: pandas.Series, filepath, show: bool = False) -> pandas.DataFrame:
+    """parses a statement file into Date, Memo and Amount. the file is read once, and only the three columns named
+    in the account's row are parsed, each with an explicit dtype. with show, the whole table is printed for the user,
+    which on a big statement takes longer than parsing it."""
+    with profiler.span('read'):
+        table = pandas.read_csv(filepath, **statement_read_options(account_data))
+    with profiler.span('trim'):
+        table = trim_table(account_data, table)
+    if show:
+        with profiler.span('display'):
+            print(display_amounts(table).to_string())
+    return table
+
+
+def statement_read_options(account_data: pandas.Series) -> dict:
+    """read_csv arguments for an account's statements: headers or positions depending on the parsing protocol, just
+    the date, memo and amount columns, all read as text. trim_table turns the amounts into cents."""
+    parsing_protocol = account_data['parsing_protocol']
+    if parsing_protocol == 1:  # headers
+        columns = [account_data['date_column'], account_data['memo_column'], account_data['amount_column']]
+        header = 0
+    elif parsing_protocol == 2:  # indexed, no header row
+        columns = [int(account_data['date_column']), int(account_data['memo_column']),
+                   int(account_data['amount_column'])]
+        header = None
+    else:
+        raise Exception(f'you need to write the protocol for {parsing_protocol=}')
+    date_column, memo_column, amount_column = columns
+    return {
+        'header': header,
+        'usecols': columns,
+        'dtype': {date_column: str, memo_column: str, amount_column: str},
+    }
+
+
+def read_statement_sample(filepath, rows: int = 20) -> pandas.DataFrame:
+    """the first few raw rows of a statement, for showing the user when setting up an account for it"""
+    return pandas.read_csv(filepath, header=None, nrows=rows)
+
+
+def trim_table(account_data: pandas.Series, table: pandas.DataFrame) -> pandas.DataFrame:
+    """cuts a statement read with the account's header setting down to Date, Memo and Amount, with the amount in
+    integer cents and its sign flipped if the account needs it"""
     date_column = account_data['date_column']
     memo_column = account_data['memo_column']
     amount_column = account_data['amount_column']
-    flip_amount = bool(account_data['flip_amount'])
-    parsing_protocol = account_data['parsing_protocol']
-    # first lets see if the dataframe handled it for us already
-    if parsing_protocol == 1:
-        # reread it as a headed CSV
-        os.chdir('raw_data')
-        table = pandas.read_csv(filename)
-        os.chdir('..')
-        # trim the table based on the selected headers
-        columns_to_keep = [
-            date_column,
-            memo_column,
-            amount_column
-        ]  # get the column headers we want from account_data
-    elif parsing_protocol == 2:
-        # copy raw data so we don't change it
-        table = raw_data.copy()
-        # target headers for rename
-        columns_to_keep = [
-            int(date_column),
-            int(memo_column),
-            int(amount_column)
-        ]  # get the column headers we want from account_data
+    if account_data['parsing_protocol'] == 1:
+        columns_to_keep = [date_column, memo_column, amount_column]
     else:
-        raise Exception(f'you need to write the protocol for {parsing_protocol=}')
-    table = table.loc[:, columns_to_keep]  # filter columns
+        columns_to_keep = [int(date_column), int(memo_column), int(amount_column)]
+    table = table.loc[:, columns_to_keep]  # filter and order columns, read_csv's usecols keeps them in file order
     table.columns = [
         'Date',
         'Memo',
         'Amount'
     ]  # clean headers to replace old ones with
-    if flip_amount:
-        table['Amount'] = table['Amount'].apply(lambda x: -float(x))
-    print(table.to_string())
+    table['Amount'] = normalize_amounts(table['Amount'])  # exact integer cents from here on
+    if bool(account_data['flip_amount']):
+        table['Amount'] = -table['Amount']
     return table
 
 
+def read_statement_chunks(filepath, account_data: pandas.Series, chunk_rows: int):
+    """yields a statement file chunk_rows rows at a time, read the same way make_table reads it"""
+    with pandas.read_csv(filepath, chunksize=chunk_rows, **statement_read_options(account_data)) as reader:
+        yield from reader
+
+
 # execution
 
 
 def main():
+    configure_logging()
+    if '--profile' in sys.argv[1:]:  # same as setting the MY_PROGRAM_PROFILE environment variable
+        profiler.enabled = True
     # program runs
     # use prompts to get into a consistent folder
     start_menu()
     # user chooses view or modify (only modify if new)
-    main_menu()
+    try:
+        main_menu()
+    finally:
+        # the session's database connection is shared by every helper, close it once on the way out
+        connection_manager.close_all()
+        print(query_stats.summary())
 
     # session opens the first raw_data file
     # -if filenames gets a hit, process the file in the way of that account
@@ -0,0 +1,179 @@
+"""Page-at-a-time views of query results and saved tables for the menus, so a big table is read and printed a page
+at a time instead of being rendered whole.
+
+A Pager reads rows from its source only as far as the pages that have been looked at, and keeps those so going back
+a page doesn't read anything again. It stops at max_rows rows (MAX_ROWS unless told otherwise, None for no limit),
+so paging on through a huge result can't read all of it into memory. Its footer says when results were cut off.
+
+A source is anything with a fetchmany(count) that returns a list of row tuples, which an sqlite3 cursor already is.
+FrameChunks does the same for DataFrames read in chunks.
+
+browse() shows a pager's pages and takes these at its prompt:
+
+    enter or n - next page (or done, on the last one)
+    p          - previous page
+    a number   - that page
+    q          - done
+"""
+from __future__ import annotations
+import time
+from typing import Callable, Dict, Iterable, List
+
+from import_utilities import lazy_import
+
+pandas = lazy_import('pandas')
+
+PAGE_SIZE = 50
+MAX_ROWS = 10000
+
+
+class FrameChunks:
+    """Rows of DataFrames as tuples, a fetchmany at a time, for paging through a table that is read in chunks.
+
+    Args:
+        frames (Iterable[pandas.DataFrame]): the table's chunks in order, read as they're needed
+    """
+
+    def __init__(self, frames: Iterable[pandas.DataFrame]):
+        self._frames = iter(frames)
+        self._rows = iter(())
+
+    def fetchmany(self, count: int) -> list:
+        rows = []
+        while len(rows) < count:
+            row = next(self._rows, None)
+            if row is None:
+                frame = next(self._frames, None)
+                if frame is None:
+                    break
+                self._rows = frame.itertuples(index=False, name=None)
+                continue
+            rows.append(row)
+        return rows
+
+
+class Pager:
+    """The rows of a source, a page at a time.
+
+    Args:
+        rows: the source, anything with fetchmany(count) -> list of row tuples
+        columns (List[str]): the column names
+        page_size (int): rows per page
+        formatters (Dict[str, Callable]): column name (lower case) -> function turning its values into text. other
+            values are shown with str().
+        max_rows (int | None): the most rows read from the source, None for all of them
+    """
+
+    def __init__(self, rows, columns: List[str], page_size: int = PAGE_SIZE, formatters: Dict[str, Callable] = None,
+                 max_rows: int | None = MAX_ROWS):
+        self.columns = [str(column) for column in columns]
+        self.page_size = page_size
+        self.formatters = formatters or {}
+        self.max_rows = max_rows
+        self.exhausted = False
+        # whether the source had more than max_rows rows
+        self.truncated = False
+        # time spent reading from the source
+        self.read_seconds = 0.0
+        self._source = rows
+        self._rows = []
+
+    @classmethod
+    def from_cursor(cls, cursor, **kwargs) -> Pager:
+        return cls(cursor, [description[0] for description in cursor.description], **kwargs)
+
+    def _read_to(self, count: int):
+        while len(self._rows) < count and not self.exhausted:
+            start = time.perf_counter()
+            batch = self._source.fetchmany(self.page_size)
+            self.read_seconds += time.perf_counter() - start
+            self._rows.extend(batch)
+            if len(batch) < self.page_size:
+                self.exhausted = True
+            if self.max_rows is not None and len(self._rows) > self.max_rows:
+                del self._rows[self.max_rows:]
+                self.exhausted = self.truncated = True
+
+    def page(self, number: int) -> list:
+        """the rows on page number (counting from 0), empty past the end. the source is read a row past the page, so
+        is_last_page is known for it."""
+        self._read_to((number + 1) * self.page_size + 1)
+        return self._rows[number * self.page_size:(number + 1) * self.page_size]
+
+    def is_last_page(self, number: int) -> bool:
+        self._read_to((number + 1) * self.page_size + 1)
+        return self.exhausted and len(self._rows) <= (number + 1) * self.page_size
+
+    @property
+    def rows_read(self) -> int:
+        return len(self._rows)
+
+    @property
+    def pages(self) -> int:
+        """the number of pages read so far, all of them once the source is exhausted"""
+        return max(-(-self.rows_read // self.page_size), 1)
+
+    def render(self, number: int) -> str:
+        """the page as a table of right aligned columns, the rows numbered from the start of the results"""
+        first = number * self.page_size
+        lines = [[''] + self.columns]
+        for row_number, row in enumerate(self.page(number), start=first):
+            lines.append([str(row_number)] + [self._format(column, value) for column, value in zip(self.columns, row)])
+        widths = [max(len(line[position]) for line in lines) for position in range(len(lines[0]))]
+        return '\n'.join('  '.join(text.rjust(width) for text, width in zip(line, widths)).rstrip() for line in lines)
+
+    def _format(self, column, value) -> str:
+        formatter = self.formatters.get(column.lower())
+        return formatter(value) if formatter is not None else str(value)
+
+    def footer(self, number: int, show_time: bool = False) -> str:
+        first = number * self.page_size
+        shown = len(self.page(number))
+        # short of the end, the totals are how much has been read, with more to come
+        more = '' if self.exhausted else '+'
+        text = (f'rows {first + 1 if shown else 0}-{first + shown} of {self.rows_read}{more}, '
+                f'page {number + 1} of {self.pages}{more}')
+        if show_time:
+            text += f', {1000 * self.read_seconds:.1f}ms reading'
+        if self.truncated:
+            text += f', cut off at {self.max_rows} rows'
+        return text
+
+
+def browse(pager: Pager, wait: bool = True, show_time: bool = False):
+    """shows the pager's first page and then the ones asked for. with wait unset, a result that fits on one page is
+    just printed, with no prompt."""
+    number = 0
+    show = True
+    while True:
+        if show:
+            print(pager.render(number))
+            print(pager.footer(number, show_time))
+        show = True
+        last = pager.is_last_page(number)
+        if last and number == 0 and not wait:
+            return
+        if last:
+            prompt = 'enter or q: done, p: previous page, a number: go to that page\n> '
+        else:
+            prompt = 'enter: next page, p: previous page, a number: go to that page, q: done\n> '
+        answer = input(prompt).strip().lower()
+        if answer in ('', 'n'):
+            if last:
+                return
+            number += 1
+        elif answer == 'p':
+            number = max(number - 1, 0)
+        elif answer.isdigit() and int(answer) >= 1:
+            wanted = int(answer) - 1
+            pager.page(wanted)
+            if wanted and wanted * pager.page_size >= pager.rows_read:
+                print(f'there are only {pager.pages} pages')
+                show = False
+                continue
+            number = wanted
+        elif answer == 'q':
+            return
+        else:
+            print(f"'{answer}' is not one of the choices")
+            show = False
@@ -0,0 +1,134 @@
+"""Opt-in timing of the stages of a pipeline, like a statement import.
+
+Turn it on by setting the MY_PROGRAM_PROFILE environment variable (to anything but '', '0' or 'false') or by running
+my_program with --profile. While it's off, spans and runs cost next to nothing.
+
+    with profiler.run('import statement.csv'):
+        with profiler.span('read'):
+            ...
+        with profiler.span('database write'):
+            ...
+
+When a run finishes, a table of time per span is printed, and the whole run's cProfile stats are dumped to
+PROFILE_DIRECTORY, where `python -m pstats` or snakeviz can open them. Spans add up their time over however many
+times they're entered during a run, so a stage done per chunk shows up as one line. Spans should be leaves, since
+nested spans are both counted in full. A run started inside another run just adds its spans to the outer one.
+
+Time spent waiting on the user goes in profiler.waiting() instead of a span. It's shown on its own line and taken
+out of the run's total, so a prompt answered slowly doesn't swamp the stages around it:
+
+    with profiler.waiting():
+        account_key = get_account_key_from_prompt(filename, sample)
+"""
+import contextlib
+import cProfile
+import datetime
+import os
+import re
+import time
+
+PROFILE_ENV_VAR = 'MY_PROGRAM_PROFILE'
+PROFILE_DIRECTORY = 'profiles'
+WAITING_SPAN = 'user input'
+
+
+def profiling_requested() -> bool:
+    return os.environ.get(PROFILE_ENV_VAR, '').strip().lower() not in ('', '0', 'false')
+
+
+class PipelineProfiler:
+    """Named timing spans grouped into runs, with a cProfile dump per run.
+
+    Args:
+        enabled (bool): whether spans and runs are measured at all
+        dump_directory (str | None): where each run's cProfile stats are written, relative to the working directory
+            when the run ends. None keeps the timing table but skips cProfile.
+    """
+
+    def __init__(self, enabled: bool = False, dump_directory: str | None = PROFILE_DIRECTORY):
+        self.enabled = enabled
+        self.dump_directory = dump_directory
+        self._depth = 0
+        self._spans = {}
+        self._waiting = (0, 0.0)
+        self._label = None
+        self._started = None
+
+    @contextlib.contextmanager
+    def span(self, name):
+        if not self.enabled or not self._depth:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            calls, total = self._spans.get(name, (0, 0.0))
+            self._spans[name] = (calls + 1, total + seconds)
+
+    @contextlib.contextmanager
+    def waiting(self):
+        """times a wait for the user, which breakdown() leaves out of the run's total"""
+        if not self.enabled or not self._depth:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            calls, total = self._waiting
+            self._waiting = (calls + 1, total + time.perf_counter() - start)
+
+    @contextlib.contextmanager
+    def run(self, label):
+        if not self.enabled or self._depth:
+            self._depth += int(self.enabled)
+            try:
+                yield
+            finally:
+                self._depth -= int(self.enabled)
+            return
+        self._depth, self._spans, self._waiting, self._label = 1, {}, (0, 0.0), label
+        profile = cProfile.Profile() if self.dump_directory else None
+        self._started = time.perf_counter()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            total = time.perf_counter() - self._started
+            self._depth = 0
+            print(self.breakdown(total))
+            if profile is not None:
+                print(f'cProfile stats saved to {self.dump(profile)}')
+
+    def breakdown(self, total: float) -> str:
+        """the spans of the current run by time, with whatever wasn't inside a span as 'other'. time spent waiting for
+        the user is listed after them and isn't part of the total or the shares."""
+        waiting_calls, waiting_seconds = self._waiting
+        total = max(total - waiting_seconds, 0.0)
+        rows = sorted(self._spans.items(), key=lambda item: item[1][1], reverse=True)
+        rows.append(('other', (0, max(total - sum(seconds for _, seconds in self._spans.values()), 0.0))))
+        name_width = max(len(name) for name, _ in rows + [(WAITING_SPAN, None)])
+        lines = [f'profile of {self._label}: {total:.3f}s',
+                 f'\t{"stage":<{name_width}} {"calls":>7} {"seconds":>9} {"share":>7}']
+        for name, (calls, seconds) in rows:
+            share = seconds / total if total else 0.0
+            lines.append(f'\t{name:<{name_width}} {calls or "":>7} {seconds:>9.3f} {share:>7.1%}')
+        if waiting_calls:
+            lines.append(f'\t{WAITING_SPAN:<{name_width}} {waiting_calls:>7} {waiting_seconds:>9.3f} {"-":>7}')
+        return '\n'.join(lines)
+
+    def dump(self, profile: cProfile.Profile) -> str:
+        os.makedirs(self.dump_directory, exist_ok=True)
+        stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        label = re.sub(r'[^\w.-]+', '_', str(self._label))[:60]
+        path = os.path.join(self.dump_directory, f'{stamp}-{label}.prof')
+        profile.dump_stats(path)
+        return path
+
+
+profiler = PipelineProfiler(enabled=profiling_requested())
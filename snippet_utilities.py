@@ -0,0 +1,180 @@
+from __future__ import annotations
+from collections import deque
+from typing import Any, Dict, Iterable, List, Tuple
+
+
+class SnippetMatcher:
+    """An Aho-Corasick automaton over a list of snippets, so a memo can be checked against every snippet in one pass
+    over its characters instead of one `snippet in memo` test per snippet.
+
+    Matching is case-sensitive plain substring matching, exactly like `snippet in memo`.
+
+    Tie-break: when several snippets occur in the same memo, the one that came first in the input order wins (for the
+    snippets table that's table order, which is what the old `iterrows()` loop picked). If the same snippet text is
+    given twice, the first one's value is kept.
+
+    Args:
+        snippets (Iterable[Tuple[str, Any]]): (snippet, value) pairs in priority order. value is what match() returns,
+            normally the snippet_key.
+    """
+
+    def __init__(self, snippets: Iterable[Tuple[str, Any]]):
+        # node 0 is the root. each node has a dict of child transitions, a fail link and the best (lowest) priority
+        # of any snippet ending at this node or at any node down its chain of fail links. for finding every snippet
+        # in a memo, each node also has the priority of the snippet ending exactly there and an output link to the
+        # next node down its fail chain where one ends (0 for none)
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._best: List[int | None] = [None]
+        self._own: List[int | None] = [None]
+        self._output: List[int] = [0]
+        self.values: List[Any] = []
+        for priority, (snippet, value) in enumerate(snippets):
+            self.values.append(value)
+            self._add(str(snippet), priority)
+        self._link()
+
+    def __len__(self):
+        return len(self.values)
+
+    def _add(self, snippet: str, priority: int):
+        node = 0
+        for char in snippet:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._best.append(None)
+                self._own.append(None)
+                self._output.append(0)
+            node = next_node
+        if self._best[node] is None:  # duplicates keep the first one
+            self._best[node] = priority
+            self._own[node] = priority
+
+    def _link(self):
+        """breadth first pass setting the fail links and folding each fail target's best priority into its node"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._best[child] = _min_priority(self._best[child], self._best[self._fail[child]])
+                fail = self._fail[child]
+                self._output[child] = fail if fail and self._own[fail] is not None else self._output[fail]
+
+    def match_priority(self, memo: str) -> int | None:
+        """returns the input position of the winning snippet for memo, or None if no snippet is in it"""
+        goto, fail, best_at = self._goto, self._fail, self._best
+        best = best_at[0]  # an empty snippet matches everything
+        if best == 0:
+            return best
+        node = 0
+        for char in memo:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            candidate = best_at[node]
+            if candidate is not None and (best is None or candidate < best):
+                best = candidate
+                if best == 0:  # can't do better than the first snippet
+                    break
+        return best
+
+    def match_priorities(self, memo: str) -> set:
+        """returns the input positions of every snippet in memo, not just the winning one"""
+        goto, fail, own, output = self._goto, self._fail, self._own, self._output
+        found = set() if own[0] is None else {own[0]}
+        node = 0
+        for char in memo:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            hit = node if own[node] is not None else output[node]
+            while hit:
+                found.add(own[hit])
+                hit = output[hit]
+        return found
+
+    def match(self, memo: str, default: Any = None) -> Any:
+        """returns the value of the winning snippet for memo, or default if no snippet is in it"""
+        priority = self.match_priority(memo)
+        return default if priority is None else self.values[priority]
+
+    def match_all(self, memos: Iterable[str], default: Any = None) -> list:
+        return [self.match(memo, default) for memo in memos]
+
+
+def snippet_overlaps(snippets: Iterable[Tuple[str, Any]], memos: Dict[str, int], involving: Any = None) -> List[dict]:
+    """Finds the pairs of snippets that shadow each other: one contains the other, or both are in the same memos.
+    Since the first snippet in a memo wins, the later snippet of a pair loses every shared memo to the earlier one.
+
+    :param snippets: (snippet, value) pairs for one account in table order, the order classification tries them in
+    :param memos: memo -> how many transactions have it. hits are counted over these.
+    :param involving: a snippet's value, to only report the pairs with that snippet in them
+    :return: a dict per pair, the earlier snippet first, most shared transactions first:
+        first, second: the snippets' values
+        first_snippet, second_snippet: their text
+        relation: 'duplicate' (same text), 'first in second', 'second in first' or 'shared memos'
+        shared: transactions whose memo has both, which all go to the first
+        first_hits, second_hits: transactions whose memo has each
+    """
+    snippets = [(str(snippet), value) for snippet, value in snippets]
+    matcher = SnippetMatcher(snippets)
+    # repeated text only gets into the matcher once, under its first position
+    first_with_text = {}
+    for position, (snippet, _) in enumerate(snippets):
+        first_with_text.setdefault(snippet, position)
+
+    hits: Dict[int, int] = {}
+    shared: Dict[Tuple[int, int], int] = {}
+    for memo, transactions in memos.items():
+        found = sorted(matcher.match_priorities(str(memo)))
+        for index, first in enumerate(found):
+            hits[first] = hits.get(first, 0) + transactions
+            for second in found[index + 1:]:
+                shared[first, second] = shared.get((first, second), 0) + transactions
+
+    relations: Dict[Tuple[int, int], str] = {}
+    for position, (snippet, _) in enumerate(snippets):
+        original = first_with_text[snippet]
+        if original != position:
+            relations[original, position] = 'duplicate'
+            continue
+        for inside in matcher.match_priorities(snippet) - {position}:
+            pair = (min(inside, position), max(inside, position))
+            relations[pair] = 'first in second' if inside < position else 'second in first'
+
+    overlaps = []
+    for first, second in set(shared) | set(relations):
+        if involving is not None and involving not in (snippets[first][1], snippets[second][1]):
+            continue
+        relation = relations.get((first, second), 'shared memos')
+        first_hits = hits.get(first, 0)
+        overlaps.append({
+            'first': snippets[first][1],
+            'second': snippets[second][1],
+            'first_snippet': snippets[first][0],
+            'second_snippet': snippets[second][0],
+            'relation': relation,
+            'shared': first_hits if relation == 'duplicate' else shared.get((first, second), 0),
+            'first_hits': first_hits,
+            'second_hits': first_hits if relation == 'duplicate' else hits.get(second, 0),
+        })
+    overlaps.sort(key=lambda overlap: (-overlap['shared'], overlap['first_snippet'], overlap['second_snippet']))
+    return overlaps
+
+
+def _min_priority(a: int | None, b: int | None) -> int | None:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return min(a, b)
+
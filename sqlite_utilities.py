@@ -1,18 +1,239 @@
+from __future__ import annotations
+import atexit
+import contextlib
+import logging
+import os
 import sqlite3
-import pandas
-import pandas_utilities
+import threading
+import time
+
+from import_utilities import is_imported, lazy_import
+
+numpy = lazy_import('numpy')
+pandas = lazy_import('pandas')
+
+
+_numpy_adapters_registered = False
+
+
+def register_numpy_adapters():
+    """keys and values read back through pandas come out as numpy scalars, which sqlite3 would otherwise bind as
+    blobs. numpy is only imported once something needs it, and there can't be numpy values to bind before that, so
+    this is checked before each statement instead of at import."""
+    global _numpy_adapters_registered
+    if _numpy_adapters_registered or not is_imported('numpy'):
+        return
+    for numpy_type, python_type in ((numpy.int64, int), (numpy.int32, int), (numpy.float64, float),
+                                    (numpy.bool_, bool)):
+        sqlite3.register_adapter(numpy_type, python_type)
+    _numpy_adapters_registered = True
+
+
+# pragmas applied to every connection the ConnectionManager opens. 'default' leaves sqlite's own settings alone.
+PRAGMA_PROFILES = {
+    'default': {},
+    'tuned': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -64000,  # negative means KiB, so ~64MB
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY',
+    },
+}
+
+
+class ConnectionManager:
+    """Keeps one open connection per database file (and per thread, since sqlite connections can't be shared
+    across threads) for the life of a session, instead of opening and closing the file for every query.
+
+    Args:
+        pragmas (str | dict): the name of a profile in PRAGMA_PROFILES, or a dict of pragma names to values
+        cached_statements (int): how many prepared statements each connection keeps for reuse. a statement is
+            reused whenever the same sql text runs again, which is why queries take their values as parameters
+    """
+
+    def __init__(self, pragmas: str | dict = 'tuned', cached_statements: int = 256):
+        self.pragmas = PRAGMA_PROFILES[pragmas] if isinstance(pragmas, str) else dict(pragmas)
+        self.cached_statements = cached_statements
+        self._connections = {}
+        self._users = {}
+        # how many DbSession.transaction blocks are open on each connection, across every session sharing it
+        self._transactions = {}
+        self._lock = threading.Lock()
+
+    def configure(self, pragmas: str | dict):
+        """switches the pragma profile. connections that are already open are closed so they pick it up."""
+        self.close_all()
+        self.pragmas = PRAGMA_PROFILES[pragmas] if isinstance(pragmas, str) else dict(pragmas)
+
+    @staticmethod
+    def key(filepath) -> tuple:
+        # the program moves around with os.chdir, so relative paths are pinned down when first seen
+        return os.path.abspath(filepath), threading.get_ident()
+
+    def get(self, filepath) -> sqlite3.Connection:
+        key = self.key(filepath)
+        with self._lock:
+            connection = self._connections.get(key)
+            if connection is None:
+                connection = sqlite3.connect(key[0], cached_statements=self.cached_statements)
+                for pragma, value in self.pragmas.items():
+                    connection.execute(f'PRAGMA {pragma} = {value}')
+                self._connections[key] = connection
+        return connection
+
+    def acquire(self, filepath) -> tuple:
+        """like get, but counts the caller as a user of the connection until it calls release with the returned key"""
+        key = self.key(filepath)
+        connection = self.get(filepath)
+        with self._lock:
+            self._users[key] = self._users.get(key, 0) + 1
+        return key, connection
+
+    def release(self, key) -> int:
+        """returns how many users the connection still has"""
+        with self._lock:
+            self._users[key] = max(self._users.get(key, 0) - 1, 0)
+            return self._users[key]
+
+    def enter_transaction(self, key) -> int:
+        """counts a transaction block opened on the connection, returns how many were already open"""
+        with self._lock:
+            depth = self._transactions.get(key, 0)
+            self._transactions[key] = depth + 1
+            return depth
+
+    def exit_transaction(self, key):
+        with self._lock:
+            self._transactions[key] = max(self._transactions.get(key, 0) - 1, 0)
+
+    def in_transaction(self, key) -> bool:
+        """whether any session on the connection has a transaction block open"""
+        return self._transactions.get(key, 0) > 0
+
+    def close(self, filepath):
+        """closes the calling thread's connection to filepath, if there is one"""
+        key = self.key(filepath)
+        with self._lock:
+            connection = self._connections.pop(key, None)
+            self._users.pop(key, None)
+            self._transactions.pop(key, None)
+        if connection is not None:
+            connection.close()
+
+    def close_all(self):
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+            self._users.clear()
+            self._transactions.clear()
+        for connection in connections:
+            try:
+                connection.close()
+            except sqlite3.ProgrammingError:  # opened on another thread, which has to close it itself
+                pass
+
+
+connection_manager = ConnectionManager()
+atexit.register(connection_manager.close_all)
+
+# every statement is logged here at DEBUG, and slow ones with their query plan at WARNING (DEBUG in quiet_sessions)
+query_logger = logging.getLogger('my_app.sql')
+
+
+class QueryStats:
+    """Call counts, wall time and rows returned/affected for every statement run through a DbSession, over the whole
+    run of the program. Statements are grouped by their text with the whitespace collapsed, so a helper's query is
+    one entry however many different parameters it was run with.
+
+    Args:
+        slow_query_seconds (float | None): statements taking at least this long are logged with their
+            EXPLAIN QUERY PLAN output. None turns that off.
+    """
+
+    def __init__(self, slow_query_seconds: float | None = 0.25):
+        self.slow_query_seconds = slow_query_seconds
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def statement(query) -> str:
+        return ' '.join(query.split())
+
+    def record(self, query, seconds: float, rows: int):
+        statement = self.statement(query)
+        with self._lock:
+            stats = self._stats.setdefault(statement, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'rows': 0})
+            stats['calls'] += 1
+            stats['seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+            stats['rows'] += max(rows, 0)
+
+    def is_slow(self, seconds: float) -> bool:
+        return self.slow_query_seconds is not None and seconds >= self.slow_query_seconds
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def top(self, count: int = 10) -> list:
+        """the statements with the most total time, as dicts with statement, calls, seconds, max_seconds and rows"""
+        with self._lock:
+            stats = [{'statement': statement, **values} for statement, values in self._stats.items()]
+        return sorted(stats, key=lambda stats: stats['seconds'], reverse=True)[:count]
+
+    def summary(self, count: int = 10, width: int = 100) -> str:
+        top = self.top(count)
+        if not top:
+            return 'no queries run'
+        with self._lock:
+            calls = sum(stats['calls'] for stats in self._stats.values())
+            seconds = sum(stats['seconds'] for stats in self._stats.values())
+        lines = [f'{calls} statements in {seconds:.3f}s, top {len(top)} by total time:',
+                 f'{"total s":>9} {"calls":>7} {"avg ms":>9} {"max ms":>9} {"rows":>9}  statement']
+        for stats in top:
+            statement = stats['statement']
+            if len(statement) > width:
+                statement = statement[:width - 3] + '...'
+            lines.append(f'{stats["seconds"]:>9.3f} {stats["calls"]:>7} '
+                         f'{1000 * stats["seconds"] / stats["calls"]:>9.2f} {1000 * stats["max_seconds"]:>9.2f} '
+                         f'{stats["rows"]:>9}  {statement}')
+        return '\n'.join(lines)
+
+
+query_stats = QueryStats()
+
+# per thread, whether DbSession prints its opening and closing lines
+_session_output = threading.local()
+
+
+@contextlib.contextmanager
+def quiet_sessions():
+    """sessions opened on this thread inside the block don't print, and their slow queries are logged at DEBUG instead
+    of WARNING, for work on a background thread that would otherwise print over whatever the user is being asked on
+    the main one. the slow queries still count in query_stats."""
+    previous = getattr(_session_output, 'quiet', False)
+    _session_output.quiet = True
+    try:
+        yield
+    finally:
+        _session_output.quiet = previous
 
 
 class DbSession:
+    """context for running queries against a database file. the connection is borrowed from connection_manager and
+    stays open after the block exits. anything left uncommitted when the outermost session on that connection exits is
+    rolled back."""
 
     def __init__(self, filepath):
         self.filepath = filepath
         self.print_indentation_level = 0
-        self.print('Opening database file')
-        self.connection = sqlite3.connect(filepath)
+        self.print('Opening database session')
+        self._key, self.connection = connection_manager.acquire(filepath)
         self.print_indentation_level = 1
         self.commits = 0
         self.queries = 0
+        self.query_seconds = 0.0
 
     def __enter__(self):
         return self
@@ -21,50 +242,180 @@ class DbSession:
         if exc_type:
             print(f'{exc_type=}, {exc_val=}, {exc_tb=}')
         self.print_indentation_level = 0
-        self.print(f'Closing database file after {self.queries} queries and {self.commits} commits\n')
-        self.connection.close()
+        self.print(f'Closing database session after {self.queries} queries and {self.commits} commits '
+                   f'({self.query_seconds:.3f}s)\n')
+        # the old per-session connection threw away uncommitted work on close, the shared one has to do it explicitly
+        # once the outermost session using it exits
+        if connection_manager.release(self._key) == 0 and self.connection.in_transaction:
+            self.connection.rollback()
+
+    @property
+    def in_transaction(self) -> bool:
+        """whether writes are being held for a transaction block, this session's or one of another session sharing the
+        connection further up the stack"""
+        return connection_manager.in_transaction(self._key)
 
     @property
     def tables(self):
-        table_data = self.fetch_query("SELECT name FROM sqlite_master WHERE type = 'table'")
-        return table_data['name'].tolist()
+        return self.fetch_column("SELECT name FROM sqlite_master WHERE type = 'table'") or []
 
     def print(self, *args, **kwargs):
+        if getattr(_session_output, 'quiet', False):
+            return
         margin = '\t'*self.print_indentation_level
         print(margin, end='')
         print(*args, **kwargs)
 
-    def fetch_query(self, query) -> pandas.DataFrame:
-        print(query)
-        results = pandas.read_sql_query(query, self.connection)
+    def _timed(self, query, params, run, batch: bool = False):
+        """runs run(), which returns (result, rows returned or affected), and records how long it took. with batch,
+        params is the list of parameter rows of an executemany."""
+        if batch:
+            query_logger.debug('%s\nparameters: %d rows', query, len(params) if hasattr(params, '__len__') else -1)
+        elif params:
+            query_logger.debug('%s\nparameters: %r', query, params)
+        else:
+            query_logger.debug('%s', query)
+        register_numpy_adapters()
+        start = time.perf_counter()
+        result, rows = run()
+        seconds = time.perf_counter() - start
+        self.query_seconds += seconds
+        query_stats.record(query, seconds, rows)
+        if query_stats.is_slow(seconds):
+            if batch:  # a batch is explained with its first row
+                params = params[0] if isinstance(params, (list, tuple)) and params else None
+            self.log_slow_query(query, params, seconds, rows)
+        return result
+
+    def log_slow_query(self, query, params, seconds: float, rows: int):
+        level = logging.DEBUG if getattr(_session_output, 'quiet', False) else logging.WARNING
+        if not query_logger.isEnabledFor(level):
+            return
+        try:
+            plan = self.connection.execute(f'EXPLAIN QUERY PLAN {query}', params or ()).fetchall()
+            plan = '\n'.join(f'\t{detail}' for _, _, _, detail in plan) or '\t(no plan)'
+        except sqlite3.Error as err:  # not every statement can be explained, or its parameters were a batch
+            plan = f'\t(no plan: {err})'
+        # a cursor handed back unread (rows is -1) hasn't returned anything yet
+        rows_text = f'{rows} rows' if rows >= 0 else 'rows read afterwards'
+        query_logger.log(level, 'slow query, %.3fs and %s:\n%s\nplan:\n%s', seconds, rows_text,
+                         QueryStats.statement(query), plan)
+
+    def fetch_query(self, query, params=None) -> pandas.DataFrame:
+        """the results as a DataFrame, for callers that want one. params are bound to the query's ? (or :name)
+        placeholders, a sequence (or a dict)."""
+        # looked up before the clock starts, so the query that first needs pandas isn't charged for importing it
+        read_sql_query = pandas.read_sql_query
+
+        def run():
+            results = read_sql_query(query, self.connection, params=params)
+            return results, len(results)
+        results = self._timed(query, params, run)
         self.queries += 1
         return results
 
-    def fetch_single_value(self, query):
-        result_table = self.fetch_query(query)
-        if result_table.empty:
-            return None
-        return result_table.iloc[0, 0]
-
-    def fetch_column(self, query) -> list:
-        """returns a list from a query that should be structured to return only one row"""
-        result_table = self.fetch_query(query)
-        if result_table.empty:
-            return None
-        return result_table.iloc[:, 0].tolist()
-
-
-    def fetch_row(self, query) -> pandas.Series:
-        """returns a list from a query that should be structured to return only one row"""
-        result_table = self.fetch_query(query)
-        if result_table.empty:
-            return None
-        return result_table.iloc[0, :]
-
-    def commit_query(self, query):
-        print(query)
-        self.connection.execute(query)
-        self.connection.commit()
+    def open_cursor(self, query, params=None, named: bool = False) -> sqlite3.Cursor:
+        """runs a query and returns its cursor with nothing read yet, for results too big to load at once. read it with
+        fetchmany and close it when done. with named, rows come out as sqlite3.Row, which can also be indexed by
+        column name."""
+        def run():
+            cursor = self.connection.cursor()
+            if named:
+                cursor.row_factory = sqlite3.Row
+            return cursor.execute(query, params or ()), -1
+        cursor = self._timed(query, params, run)
+        self.queries += 1
+        return cursor
+
+    def iter_query(self, query, params=None, named: bool = False, size: int = 1000):
+        """yields the query's rows as tuples (sqlite3.Row with named), reading size of them at a time, so a big result
+        is gone through without a DataFrame or all of it in memory. only running the query is timed, not the reading."""
+        cursor = self.open_cursor(query, params, named)
+        try:
+            while True:
+                rows = cursor.fetchmany(size)
+                yield from rows
+                if len(rows) < size:
+                    return
+        finally:
+            cursor.close()
+
+    def _fetch(self, query, params, read, named: bool = False):
+        """runs a query, returns read(cursor) and closes the cursor. the small results of the fetch_ methods below
+        come straight from sqlite3 this way, without pandas. read returns (result, rows read)."""
+        def run():
+            cursor = self.connection.cursor()
+            if named:
+                cursor.row_factory = sqlite3.Row
+            try:
+                return read(cursor.execute(query, params or ()))
+            finally:
+                cursor.close()
+        result = self._timed(query, params, run)
+        self.queries += 1
+        return result
+
+    def fetch_single_value(self, query, params=None):
+        """the first column of the first row, None if there are no rows"""
+        def read(cursor):
+            row = cursor.fetchone()
+            return (None, 0) if row is None else (row[0], 1)
+        return self._fetch(query, params, read)
+
+    def fetch_column(self, query, params=None) -> list | None:
+        """the first column of every row as a list, None if there are no rows"""
+        def read(cursor):
+            values = [row[0] for row in cursor]
+            return values or None, len(values)
+        return self._fetch(query, params, read)
+
+    def fetch_row(self, query, params=None) -> sqlite3.Row | None:
+        """the first row, indexed by column name or position, None if there are no rows"""
+        def read(cursor):
+            row = cursor.fetchone()
+            return row, int(row is not None)
+        return self._fetch(query, params, read, named=True)
+
+    def commit_query(self, query, params=()) -> int:
+        """runs a statement that changes the database, returns the number of rows it affected"""
+        def run():
+            cursor = self.connection.execute(query, params)
+            if not self.in_transaction:
+                self.connection.commit()
+            return cursor.rowcount, cursor.rowcount
+        rowcount = self._timed(query, params, run)
+        if not self.in_transaction:
+            self.commits += 1
+        return rowcount
+
+    def commit_many(self, query, rows) -> int:
+        """runs one parameterized statement against every row in rows, returns the number of rows affected"""
+        def run():
+            cursor = self.connection.executemany(query, rows)
+            if not self.in_transaction:
+                self.connection.commit()
+            return cursor.rowcount, cursor.rowcount
+        rowcount = self._timed(query, rows, run, batch=True)
+        if not self.in_transaction:
+            self.commits += 1
+        return rowcount
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """commit_query and commit_many calls inside this block are committed together when it exits, or all rolled
+        back if it raises. blocks nest, also across sessions on the same connection: only the outermost one commits, or
+        rolls back everything if an exception makes it out of it."""
+        if connection_manager.enter_transaction(self._key):
+            try:
+                yield self
+            finally:
+                connection_manager.exit_transaction(self._key)
+            return
+        try:
+            with self.connection:
+                yield self
+        finally:
+            connection_manager.exit_transaction(self._key)
         self.commits += 1
 
     def select_all(self, table):
@@ -73,7 +424,7 @@ class DbSession:
     def get_table_info(self, table_name):
         if table_name not in self.tables:
             raise Exception(f'{table_name} not a table')
-        return self.fetch_query(f"PRAGMA table_info('{table_name}')")
+        return self.fetch_query("SELECT * FROM pragma_table_info(?)", (table_name,))
 
 
 
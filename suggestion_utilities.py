@@ -0,0 +1,182 @@
+"""Snippet suggestions for match_unmatched_transactions, from word n-gram statistics over the memos in the database.
+
+For a group of unmatched memos on an account, the candidates are the runs of up to a few whole words in the group's
+first memo. A candidate is suggested when no memo on the account classified under a different vendor contains it.
+Candidates without digits come first, since store, card and reference numbers don't say who the vendor is, then the
+ones in the most memos of the group, then the shortest.
+
+Each account is loaded on first use, distinct memos only. Its classified memos go into two structures:
+- a word n-gram -> vendors index, which rules out candidates another vendor's memos have as whole words with a
+  dict lookup
+- each vendor's memos joined into one string, which the candidates that get past the index are checked against,
+  since a snippet also matches inside words
+
+Both are capped (max_memos distinct memos, max_ngrams index entries), which bounds memory. Past the n-gram cap,
+candidates are just checked against the text. record() folds in the memos a new snippet labels, so the statistics
+stay current for the whole classification run without reloading.
+"""
+from __future__ import annotations
+import re
+import threading
+from typing import Dict, List, Tuple
+
+from sqlite_utilities import DbSession
+
+# separates memos in the joined text, so a candidate can't match across two of them
+MEMO_SEPARATOR = '\x00'
+
+
+class AccountMemos:
+    """The memos of one account, split into unmatched ones and classified ones by vendor.
+
+    Args:
+        max_words (int): the longest word n-gram indexed
+        max_ngrams (int): how many n-grams the index keeps at most
+    """
+
+    def __init__(self, max_words: int, max_ngrams: int):
+        self.max_words = max_words
+        self.max_ngrams = max_ngrams
+        # memo -> how many unmatched transactions have it
+        self.unmatched: Dict[str, int] = {}
+        # vendor_key (None for snippets without one) -> the vendor's distinct memos, joined
+        self.vendor_text: Dict[int | None, str] = {}
+        # ' '-joined word n-gram -> vendor_keys of the classified memos that contain it
+        self.ngram_vendors: Dict[str, set] = {}
+
+    def add_classified(self, memos: List[str], vendor_key):
+        if not memos:
+            return
+        text = MEMO_SEPARATOR.join(memos)
+        previous = self.vendor_text.get(vendor_key)
+        self.vendor_text[vendor_key] = text if previous is None else previous + MEMO_SEPARATOR + text
+        for memo in memos:
+            for ngram in word_ngrams(memo, self.max_words):
+                vendors = self.ngram_vendors.get(ngram)
+                if vendors is None:
+                    if len(self.ngram_vendors) >= self.max_ngrams:
+                        continue
+                    vendors = self.ngram_vendors[ngram] = set()
+                vendors.add(vendor_key)
+
+    def conflicts(self, candidate, vendor_key) -> bool:
+        """whether a memo classified under another vendor contains candidate"""
+        vendors = self.ngram_vendors.get(' '.join(candidate.split()))
+        if vendors is not None and vendors - {vendor_key}:
+            return True
+        return any(candidate in text for other, text in self.vendor_text.items() if other != vendor_key)
+
+
+def word_ngrams(memo, max_words: int) -> set:
+    words = str(memo).split()
+    return {' '.join(words[start:start + length])
+            for length in range(1, max_words + 1) for start in range(len(words) - length + 1)}
+
+
+def candidate_snippets(memo, max_words: int, min_length: int = 3) -> List[str]:
+    """every run of 1 to max_words whole words in memo, sliced out of it as is so they're substrings of it. runs that
+    start or end on a word that's only punctuation are left out."""
+    words = [(match.start(), match.end()) for match in re.finditer(r'\S+', str(memo))]
+    has_alphanumeric = [any(character.isalnum() for character in memo[start:end]) for start, end in words]
+    candidates = []
+    for first in range(len(words)):
+        if not has_alphanumeric[first]:
+            continue
+        for last in range(first, min(first + max_words, len(words))):
+            if not has_alphanumeric[last]:
+                continue
+            candidate = memo[words[first][0]:words[last][1]]
+            if len(candidate) >= min_length:
+                candidates.append(candidate)
+    return list(dict.fromkeys(candidates))
+
+
+class SnippetSuggester:
+    """Suggests snippets for groups of unmatched memos, loading each account's memo statistics once.
+
+    Args:
+        filepath (str): the database file
+        max_words (int): the most words in a suggestion
+        max_memos (int): the most distinct memos loaded per account, the most recent ones
+        max_ngrams (int): the most n-grams indexed per account
+    """
+
+    def __init__(self, filepath, max_words: int = 4, max_memos: int = 200000, max_ngrams: int = 500000):
+        self.filepath = filepath
+        self.max_words = max_words
+        self.max_memos = max_memos
+        self.max_ngrams = max_ngrams
+        self._accounts: Dict[int, AccountMemos] = {}
+        self._lock = threading.RLock()
+
+    def account(self, account_key) -> AccountMemos:
+        account_key = int(account_key)
+        with self._lock:
+            if account_key not in self._accounts:
+                self._accounts[account_key] = self._load(account_key)
+            return self._accounts[account_key]
+
+    def _load(self, account_key: int) -> AccountMemos:
+        query = """
+            SELECT
+                transactions.memo,
+                snippets.vendor_key,
+                transactions.snippet_key = '' AS unmatched,
+                count(*) AS transactions
+            FROM transactions
+            LEFT JOIN snippets
+                ON snippets.snippet_key = transactions.snippet_key
+            WHERE transactions.account_key = ?
+            GROUP BY transactions.memo, snippets.vendor_key, unmatched
+            ORDER BY max(transactions.transaction_key) DESC
+            LIMIT ?
+        """
+        memos = AccountMemos(self.max_words, self.max_ngrams)
+        by_vendor = {}
+        with DbSession(self.filepath) as conn:
+            for memo, vendor_key, unmatched, transactions in conn.iter_query(query, (account_key, self.max_memos)):
+                memo = str(memo)
+                if unmatched:
+                    memos.unmatched[memo] = memos.unmatched.get(memo, 0) + transactions
+                else:
+                    by_vendor.setdefault(vendor_key, []).append(memo)
+        for vendor_key, vendor_memos in by_vendor.items():
+            memos.add_classified(vendor_memos, vendor_key)
+        return memos
+
+    def suggest(self, account_key, memos: List[str], vendor_key, count: int = 3) -> List[Tuple[str, int, int]]:
+        """snippets for a group of memos (one per transaction) on an account, about to be classified under vendor_key
+
+        :return: up to count (snippet, transactions of the group it's in, other unmatched transactions it would label)
+        """
+        account = self.account(account_key)
+        vendor_key = None if vendor_key is None else int(vendor_key)
+        group = {}
+        for memo in memos:
+            group[str(memo)] = group.get(str(memo), 0) + 1
+        ranked = []
+        for position, candidate in enumerate(candidate_snippets(str(memos[0]), self.max_words)):
+            covered = sum(transactions for memo, transactions in group.items() if candidate in memo)
+            has_digit = any(character.isdigit() for character in candidate)
+            ranked.append((has_digit, -covered, len(candidate), position, candidate))
+        ranked.sort()
+        suggestions = []
+        with self._lock:
+            for _, negative_covered, _, _, candidate in ranked:
+                if account.conflicts(candidate, vendor_key):
+                    continue
+                labelled = sum(transactions for memo, transactions in account.unmatched.items() if candidate in memo)
+                suggestions.append((candidate, -negative_covered, labelled + negative_covered))
+                if len(suggestions) == count:
+                    break
+        return suggestions
+
+    def record(self, account_key, snippet, vendor_key):
+        """a snippet was added and labelled the account's unmatched memos that contain it, under vendor_key"""
+        account = self.account(account_key)
+        vendor_key = None if vendor_key is None else int(vendor_key)
+        with self._lock:
+            labelled = [memo for memo in account.unmatched if snippet in memo]
+            for memo in labelled:
+                del account.unmatched[memo]
+            account.add_classified(labelled, vendor_key)
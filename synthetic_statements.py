@@ -0,0 +1,267 @@
+"""Generates realistic fake statements for benchmarking and load testing.
+
+Four formats are supported, laid out like the real exports the accounts in sessions/test are set up for, and named
+so those accounts' filename snippets pick them up:
+
+    'chase' - Chase4452_Activity_*.csv, header row, Description / negative Amount for purchases
+    'wf'    - WF_*.csv, no header row: date, amount, '*', '', memo
+    'apple' - Apple Card Transactions - *.csv, header row, positive 'Amount (USD)' for purchases
+    'amz'   - AMZ_*.csv, header row, Reference Number, negative Amount for purchases
+
+Memos are drawn from a fixed pool of memo_cardinality distinct memos, with a skewed (zipf-like) popularity like real
+spending. A snippet_hit_rate share of the rows get a memo containing one of MemoPool.snippets, the rest get memos
+that contain none of them, so a snippets table seeded with those snippets classifies that share of the rows.
+Everything is generated in chunks with numpy, so 10M row files don't need 10M rows of memory.
+
+    python synthetic_statements.py out_folder --rows 1000000 --memos 5000 --hit-rate 0.7
+"""
+import argparse
+import datetime
+import os
+from typing import Dict, List
+
+import numpy
+import pandas
+
+from snippet_utilities import SnippetMatcher
+
+FORMATS = ('chase', 'wf', 'apple', 'amz')
+FILENAMES = {
+    'chase': 'Chase4452_Activity_synthetic_{rows}.csv',
+    'wf': 'WF_synthetic_{rows}.csv',
+    'apple': 'Apple Card Transactions - synthetic {rows}.csv',
+    'amz': 'AMZ_synthetic_{rows}.csv',
+}
+# how many memos each merchant appears under (different store numbers and cities)
+MEMOS_PER_MERCHANT = 4
+# popularity of the i-th memo in the pool is proportional to 1 / (i + 1) ** MEMO_SKEW
+MEMO_SKEW = 0.9
+
+_SYLLABLES = ['KA', 'VO', 'RI', 'TES', 'MAR', 'LO', 'NEX', 'QUI', 'DA', 'ZEN', 'PO', 'LU', 'BRO', 'FI', 'GAR', 'SHI',
+              'TRA', 'MO', 'VE', 'CO', 'PLA', 'YU', 'DRE', 'WIN', 'SA', 'HOL', 'BE', 'NU', 'JO', 'CRE']
+_SUFFIXES = ['MARKET', 'CAFE', 'GRILL', 'STORE', 'PHARMACY', 'FUEL', 'TAQUERIA', 'SUPPLY', 'BREWING', 'AUTO PARTS',
+             "'S DELI", 'PIZZA', 'HARDWARE', 'CINEMAS', 'PARKING', 'SALON']
+_CITIES = [('HAYWARD', 'CA'), ('SAN JOSE', 'CA'), ('OAKLAND', 'CA'), ('FREMONT', 'CA'), ('SEATTLE', 'WA'),
+           ('AUSTIN', 'TX'), ('TROY', 'MI'), ('RENO', 'NV'), ('PORTLAND', 'OR'), ('DENVER', 'CO')]
+# memo layouts. some have commas or apostrophes so the csv quoting and the database binding get exercised
+_MEMO_TEMPLATES = [
+    '{merchant} #{store:04d} {city} {state}',
+    '{merchant} {store:05d} {city} {state} USA',
+    'SQ *{merchant} {city}, {state}',
+    '{merchant}, INC PAYROLL {store:06d}',
+    'POS PURCHASE {merchant} {city} {state} {store:04d}',
+]
+_CATEGORIES = ['Food & Drink', 'Shopping', 'Groceries', 'Gas', 'Bills & Utilities', 'Entertainment', 'Travel',
+               'Health & Wellness', 'Automotive', 'Personal']
+
+
+class MemoPool:
+    """The distinct memos statements are drawn from, split into ones that contain a snippet and ones that don't.
+
+    Args:
+        memo_cardinality (int): how many distinct memos there are
+        snippet_hit_rate (float): the share of rows that should contain a snippet, between 0 and 1
+        seed (int): makes the pool (and everything generated from it) reproducible
+    """
+
+    def __init__(self, memo_cardinality: int = 500, snippet_hit_rate: float = 0.8, seed: int = 0):
+        if memo_cardinality < 1:
+            raise ValueError('memo_cardinality has to be at least 1')
+        if not 0 <= snippet_hit_rate <= 1:
+            raise ValueError('snippet_hit_rate has to be between 0 and 1')
+        self.snippet_hit_rate = snippet_hit_rate
+        self.seed = seed
+        rng = numpy.random.default_rng(seed)
+        if snippet_hit_rate in (0, 1) or memo_cardinality == 1:
+            known_memos = memo_cardinality if snippet_hit_rate > 0 else 0
+        else:
+            known_memos = min(max(round(memo_cardinality * snippet_hit_rate), 1), memo_cardinality - 1)
+        merchant_names = self._merchant_names(rng, -(-memo_cardinality // MEMOS_PER_MERCHANT) + 1)
+        known_merchants = -(-known_memos // MEMOS_PER_MERCHANT)
+        # the snippets are the known merchants' names, and no unknown memo may contain one of them
+        self.snippets: List[str] = merchant_names[:known_merchants]
+        matcher = SnippetMatcher((snippet, snippet) for snippet in self.snippets)
+        unknown_merchants = [name for name in merchant_names[known_merchants:] if matcher.match(name) is None]
+        self.known = self._memos(rng, self.snippets, known_memos, matcher, expect_match=True)
+        self.unknown = self._memos(rng, unknown_merchants, memo_cardinality - known_memos, matcher,
+                                   expect_match=False)
+        self._known_weights = _skewed_weights(len(self.known))
+        self._unknown_weights = _skewed_weights(len(self.unknown))
+
+    @staticmethod
+    def _merchant_names(rng, count: int) -> List[str]:
+        names = []
+        seen = set()
+        while len(names) < count:
+            syllables = rng.choice(_SYLLABLES, size=rng.integers(2, 4))
+            name = f"{''.join(syllables)} {rng.choice(_SUFFIXES)}".replace(" '", "'")
+            if name not in seen:
+                seen.add(name)
+                names.append(name)
+        return names
+
+    @staticmethod
+    def _memos(rng, merchants: List[str], count: int, matcher: SnippetMatcher, expect_match: bool) -> numpy.ndarray:
+        memos = []
+        seen = set()
+        attempts = 0
+        while len(memos) < count and merchants and attempts < 50 * count:
+            merchant = merchants[len(memos) % len(merchants)] if attempts < count else rng.choice(merchants)
+            attempts += 1
+            city, state = _CITIES[rng.integers(len(_CITIES))]
+            memo = _MEMO_TEMPLATES[rng.integers(len(_MEMO_TEMPLATES))].format(
+                merchant=merchant, store=int(rng.integers(1, 99999)), city=city, state=state)
+            # a template's own text could happen to contain a snippet, keep the split exact
+            if memo in seen or (matcher.match(memo) is not None) != expect_match:
+                continue
+            seen.add(memo)
+            memos.append(memo)
+        return numpy.array(memos, dtype=object)
+
+    def draw(self, rng, rows: int) -> numpy.ndarray:
+        """rows memos, snippet_hit_rate of them (on average) from the known pool"""
+        if not len(self.unknown):
+            return self.known[rng.choice(len(self.known), size=rows, p=self._known_weights)]
+        if not len(self.known):
+            return self.unknown[rng.choice(len(self.unknown), size=rows, p=self._unknown_weights)]
+        memos = self.unknown[rng.choice(len(self.unknown), size=rows, p=self._unknown_weights)]
+        hits = rng.random(rows) < self.snippet_hit_rate
+        memos[hits] = self.known[rng.choice(len(self.known), size=int(hits.sum()), p=self._known_weights)]
+        return memos
+
+
+def _skewed_weights(count: int) -> numpy.ndarray:
+    if count == 0:
+        return numpy.empty(0)
+    weights = 1 / numpy.arange(1, count + 1) ** MEMO_SKEW
+    return weights / weights.sum()
+
+
+def _money(cents: numpy.ndarray, decimals: str = '.2f') -> pandas.Series:
+    return pandas.Series(cents / 100).map(f'{{:{decimals}}}'.format)
+
+
+def _date_text(dates: numpy.ndarray) -> numpy.ndarray:
+    """MM/DD/YYYY for an array of days. a chunk only covers a few hundred distinct days, so each is formatted once."""
+    if not len(dates):
+        return numpy.empty(0, dtype=object)
+    first = dates.min()
+    offsets = (dates - first).astype(int)
+    days = first + numpy.arange(offsets.max() + 1).astype('m8[D]')
+    return pandas.Series(days).dt.strftime('%m/%d/%Y').to_numpy(dtype=object)[offsets]
+
+
+def _chunk_table(statement_format: str, rng, memos: numpy.ndarray, dates: numpy.ndarray,
+                 cents: numpy.ndarray) -> pandas.DataFrame:
+    """one chunk of a statement. cents are the amounts as money going out, so purchases are positive here."""
+    date_text = _date_text(dates)
+    posted_text = _date_text(dates + rng.integers(0, 3, size=len(dates)).astype('m8[D]'))
+    rows = len(memos)
+    if statement_format == 'chase':
+        return pandas.DataFrame({
+            'Transaction Date': date_text,
+            'Post Date': posted_text,
+            'Description': memos,
+            'Category': numpy.array(_CATEGORIES, dtype=object)[rng.integers(len(_CATEGORIES), size=rows)],
+            'Type': numpy.where(cents < 0, 'Payment', 'Sale'),
+            'Amount': _money(-cents),
+            'Memo': '',
+        })
+    if statement_format == 'wf':
+        return pandas.DataFrame({
+            0: date_text,
+            1: pandas.Series(-cents / 100).map(repr),  # wells fargo writes amounts like 300.0 and 0.15
+            2: '*',
+            3: '',
+            4: memos,
+        })
+    if statement_format == 'apple':
+        return pandas.DataFrame({
+            'Transaction Date': date_text,
+            'Clearing Date': posted_text,
+            'Description': memos,
+            'Merchant': [memo.split(' #')[0].title() for memo in memos],
+            'Category': numpy.array(_CATEGORIES, dtype=object)[rng.integers(len(_CATEGORIES), size=rows)],
+            'Type': numpy.where(cents < 0, 'Payment', 'Purchase'),
+            'Amount (USD)': _money(cents),
+            'Purchased By': 'Synthetic Person',
+        })
+    if statement_format == 'amz':
+        return pandas.DataFrame({
+            'Transaction Date': date_text,
+            'Posting Date': posted_text,
+            'Reference Number': [f'P9342{number:012X}' for number in rng.integers(0, 2 ** 47, size=rows)],
+            'Amount': _money(-cents),
+            'Description': memos,
+        })
+    raise ValueError(f'unknown statement format {statement_format!r}, expected one of {FORMATS}')
+
+
+def write_statement(filepath, statement_format: str, rows: int, pool: MemoPool, seed: int = 0,
+                    start: str = '2022-01-01', end: str = '2022-12-31', chunk_rows: int = 250000) -> str:
+    """Writes a statement of rows transactions, newest first like the real exports, with dates spread evenly from
+    end back to start. About 1 in 20 rows is money coming in (a payment or refund).
+
+    :return: filepath
+    """
+    rng = numpy.random.default_rng([seed, FORMATS.index(statement_format)])
+    first_day = numpy.datetime64(start, 'D')
+    span_days = int((numpy.datetime64(end, 'D') - first_day).astype(int))
+    header = statement_format != 'wf'
+    with open(filepath, 'w', newline='') as file:
+        for chunk_start in range(0, max(rows, 1), chunk_rows):
+            chunk_size = min(chunk_rows, rows - chunk_start)
+            if chunk_size <= 0:
+                if header:  # an empty statement still gets its header row
+                    _chunk_table(statement_format, rng, numpy.empty(0, dtype=object), numpy.empty(0, dtype='M8[D]'),
+                                 numpy.empty(0, dtype='i8')).to_csv(file, index=False)
+                break
+            positions = numpy.arange(chunk_start, chunk_start + chunk_size)
+            dates = first_day + (span_days - positions * span_days // max(rows - 1, 1)).astype('m8[D]')
+            cents = numpy.rint(rng.lognormal(mean=3.0, sigma=1.0, size=chunk_size) * 100).astype('i8') + 1
+            incoming = rng.random(chunk_size) < 0.05
+            cents[incoming] = -cents[incoming] * 10
+            table = _chunk_table(statement_format, rng, pool.draw(rng, chunk_size), dates, cents)
+            table.to_csv(file, index=False, header=header and chunk_start == 0)
+    return filepath
+
+
+def write_statement_set(directory, rows: int, pool: MemoPool = None, formats=FORMATS, seed: int = 0,
+                        **kwargs) -> Dict[str, str]:
+    """writes one statement of each format into directory, all drawing on the same memo pool
+
+    :return: {format: filepath}
+    """
+    pool = pool or MemoPool(seed=seed)
+    os.makedirs(directory, exist_ok=True)
+    return {
+        statement_format: write_statement(
+            os.path.join(directory, FILENAMES[statement_format].format(rows=rows)), statement_format, rows, pool,
+            seed=seed, **kwargs)
+        for statement_format in formats
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='writes synthetic bank statements for benchmarks and load tests')
+    parser.add_argument('directory')
+    parser.add_argument('--rows', type=int, default=10000, help='transactions per statement')
+    parser.add_argument('--memos', type=int, default=500, help='distinct memos across the statements')
+    parser.add_argument('--hit-rate', type=float, default=0.8, help='share of rows that contain a snippet')
+    parser.add_argument('--formats', nargs='+', choices=FORMATS, default=list(FORMATS))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--snippets-file', help='also write the snippets, one per line, to this file')
+    args = parser.parse_args()
+    start_time = datetime.datetime.now()
+    pool = MemoPool(args.memos, args.hit_rate, args.seed)
+    paths = write_statement_set(args.directory, args.rows, pool, args.formats, args.seed)
+    if args.snippets_file:
+        with open(args.snippets_file, 'w') as file:
+            file.write('\n'.join(pool.snippets) + '\n')
+    for statement_format, path in paths.items():
+        print(f'{statement_format}: {path} ({os.path.getsize(path) / 1e6:.1f} MB)')
+    print(f'{len(pool.snippets)} snippets, done in {(datetime.datetime.now() - start_time).total_seconds():.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,14 @@
+from cluster_utilities import cluster_key
+
+
+def test_card_purchases_are_keyed_by_merchant():
+    apple = cluster_key('PURCHASE AUTHORIZED ON 12/13 APPLE CASH 1INFINITELOOP CA S462348190867581 CARD 4176')
+    stanford = cluster_key('PURCHASE AUTHORIZED ON 07/06 STANFORD HEALTH CA PALO ALTO CA S582187553 CARD 4176')
+    assert apple == 'APPLE CASH CA'
+    assert stanford == 'STANFORD HEALTH CA'
+
+
+def test_boilerplate_is_only_skipped_before_the_merchant():
+    assert cluster_key('BILL PAY Pramod Pai RECURRING xxxxxxxx4713 ON 12-16') == 'BILL PAY PRAMOD'
+    assert cluster_key('PURCHASE AUTHORIZED ON', boilerplate=()) == 'PURCHASE AUTHORIZED ON'
+    assert cluster_key('PURCHASE AUTHORIZED ON 12/13') == 'PURCHASE AUTHORIZED ON 12/13'
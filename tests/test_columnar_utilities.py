@@ -0,0 +1,51 @@
+import os
+
+import pandas
+import pytest
+
+from columnar_utilities import ColumnarWriter, load_columnar, read_meta, save_columnar
+from ingest_utilities import normalize_amounts
+
+
+def statement(rows: int, first_row: int = 0, date: str = '01/02/2022') -> pandas.DataFrame:
+    numbers = range(first_row, first_row + rows)
+    return pandas.DataFrame({
+        'Date': [date] * rows,
+        'Memo': [f'MEMO {row}' for row in numbers],
+        'Amount': normalize_amounts([f'-{row}.{row % 100:02d}' for row in numbers]),
+    })
+
+
+def test_save_replaces_an_existing_table(tmp_path):
+    path = str(tmp_path / 'statement.cols')
+    save_columnar(statement(5), path)
+    table = statement(3)
+    save_columnar(table, path)
+    loaded = load_columnar(path)
+    assert loaded['Memo'].tolist() == ['MEMO 0', 'MEMO 1', 'MEMO 2']
+    assert loaded['Amount'].tolist() == table['Amount'].tolist() == [0, -101, -202]
+    assert os.listdir(tmp_path) == ['statement.cols']
+
+
+def test_failed_write_keeps_the_existing_table(tmp_path):
+    path = str(tmp_path / 'statement.cols')
+    table = statement(5)
+    save_columnar(table, path)
+    with pytest.raises(RuntimeError):
+        with ColumnarWriter(path) as writer:
+            writer.append(statement(2))
+            raise RuntimeError('the statement stopped parsing halfway')
+    assert load_columnar(path)['Amount'].tolist() == table['Amount'].tolist()
+    assert os.listdir(tmp_path) == ['statement.cols']
+
+
+def test_dates_that_stop_parsing_turn_the_column_into_text(tmp_path):
+    path = str(tmp_path / 'statement.cols')
+    with ColumnarWriter(path) as writer:
+        writer.append(statement(2))
+        writer.append(statement(2, first_row=2, date='2022-01-03'))
+    assert [column['kind'] for column in read_meta(path)['columns'] if column['name'] == 'Date'] == ['text']
+    loaded = load_columnar(path)
+    assert loaded['Date'].tolist() == ['01/02/2022', '01/02/2022', '2022-01-03', '2022-01-03']
+    assert loaded['Memo'].tolist() == ['MEMO 0', 'MEMO 1', 'MEMO 2', 'MEMO 3']
+    assert loaded['Amount'].tolist() == [0, -101, -202, -303]
@@ -0,0 +1,49 @@
+import tracemalloc
+
+from ingest_utilities import OccurrenceCounts
+
+CHUNK_ROWS = 5000
+
+
+def identities(rows: int) -> list:
+    """mostly distinct identities, the worst case for the counts, with every 7th row repeating an earlier one"""
+    return [('1', f'01/{row % 28 + 1:02d}/2022', f'MEMO {row % 997}', str(row if row % 7 else row // 7))
+            for row in range(rows)]
+
+
+def chunked_ordinals(rows: list, occurrences: OccurrenceCounts) -> list:
+    ordinals = []
+    for start in range(0, len(rows), CHUNK_ROWS):
+        ordinals += occurrences.ordinals(rows[start:start + CHUNK_ROWS])
+    return ordinals
+
+
+def test_ordinals_carry_on_across_chunks(tmp_path):
+    rows = identities(30000)
+    expected, seen = [], {}
+    for identity in rows:
+        expected.append(seen.get(identity, 0))
+        seen[identity] = expected[-1] + 1
+    with OccurrenceCounts(tmp_path) as occurrences:
+        assert chunked_ordinals(rows, occurrences) == expected
+    assert list(tmp_path.iterdir()) == []
+
+
+def peak_bytes(rows: int, directory) -> int:
+    """the most python memory held at once while counting rows a chunk at a time"""
+    chunks = [identities(rows)[start:start + CHUNK_ROWS] for start in range(0, rows, CHUNK_ROWS)]
+    with OccurrenceCounts(directory) as occurrences:
+        tracemalloc.start()
+        try:
+            for chunk in chunks:
+                occurrences.ordinals(chunk)
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+
+def test_memory_stays_flat_as_rows_grow(tmp_path):
+    small = peak_bytes(10000, tmp_path)
+    large = peak_bytes(100000, tmp_path)
+    # ten times the rows, the same chunk size: a dict of every identity would take ten times the memory
+    assert large < small * 1.5
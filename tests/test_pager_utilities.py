@@ -0,0 +1,32 @@
+import sqlite3
+
+from pager_utilities import Pager
+
+
+def numbers_cursor(rows: int) -> sqlite3.Cursor:
+    query = """
+        WITH RECURSIVE n(value) AS (SELECT 0 UNION ALL SELECT value + 1 FROM n WHERE value + 1 < ?)
+        SELECT value FROM n
+    """
+    return sqlite3.connect(':memory:').execute(query, (rows,))
+
+
+def test_results_past_max_rows_are_cut_off():
+    pager = Pager.from_cursor(numbers_cursor(1000), page_size=50, max_rows=120)
+    assert pager.page(2) == [(value,) for value in range(100, 120)]
+    assert pager.page(3) == []
+    assert pager.is_last_page(2)
+    assert pager.truncated and pager.rows_read == 120
+    assert pager.footer(2).endswith('cut off at 120 rows')
+
+
+def test_results_of_exactly_max_rows_are_not_cut_off():
+    pager = Pager.from_cursor(numbers_cursor(100), page_size=50, max_rows=100)
+    pager.page(5)
+    assert pager.rows_read == 100 and not pager.truncated
+
+
+def test_no_limit_reads_everything():
+    pager = Pager.from_cursor(numbers_cursor(1000), page_size=50, max_rows=None)
+    pager.page(100)
+    assert pager.rows_read == 1000 and not pager.truncated
@@ -0,0 +1,17 @@
+import time
+
+from profiling_utilities import WAITING_SPAN, PipelineProfiler
+
+
+def test_waiting_for_the_user_is_left_out_of_the_total(capsys):
+    profiler = PipelineProfiler(enabled=True, dump_directory=None)
+    with profiler.run('import statement.csv'):
+        with profiler.span('account detection'):
+            time.sleep(0.01)
+        with profiler.waiting():
+            time.sleep(0.3)
+    lines = capsys.readouterr().out.splitlines()
+    total = float(lines[0].rsplit(' ', 1)[1].rstrip('s'))
+    assert total < 0.2
+    waiting = next(line.split() for line in lines if line.strip().startswith(WAITING_SPAN))
+    assert float(waiting[-2]) >= 0.3
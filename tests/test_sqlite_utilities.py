@@ -0,0 +1,58 @@
+import logging
+
+import pytest
+
+from sqlite_utilities import DbSession, connection_manager, query_logger, query_stats, quiet_sessions
+
+
+@pytest.fixture
+def database(tmp_path):
+    filepath = str(tmp_path / 'nested.db')
+    with quiet_sessions(), DbSession(filepath) as conn:
+        conn.commit_query("CREATE TABLE rows (value INTEGER)")
+    yield filepath
+    connection_manager.close(filepath)
+
+
+def values(filepath) -> list:
+    with quiet_sessions(), DbSession(filepath) as conn:
+        return conn.fetch_column("SELECT value FROM rows ORDER BY value") or []
+
+
+def test_nested_session_leaves_the_outer_transaction_open(database):
+    with quiet_sessions(), DbSession(database) as outer, outer.transaction():
+        outer.commit_query("INSERT INTO rows VALUES (1)")
+        with DbSession(database) as inner:
+            assert inner.connection is outer.connection
+            inner.commit_query("INSERT INTO rows VALUES (2)")
+            inner.commit_many("INSERT INTO rows VALUES (?)", [(3,), (4,)])
+        assert outer.connection.in_transaction
+        assert inner.commits == 0
+    assert values(database) == [1, 2, 3, 4]
+
+
+def test_outer_rollback_undoes_the_nested_session_writes(database):
+    with pytest.raises(RuntimeError), quiet_sessions(), DbSession(database) as outer, outer.transaction():
+        outer.commit_query("INSERT INTO rows VALUES (1)")
+        with DbSession(database) as inner, inner.transaction():
+            inner.commit_query("INSERT INTO rows VALUES (2)")
+        raise RuntimeError('abandon the outer transaction')
+    assert values(database) == []
+    with quiet_sessions(), DbSession(database) as conn:
+        assert not conn.in_transaction
+        conn.commit_query("INSERT INTO rows VALUES (5)")
+    assert values(database) == [5]
+
+
+def test_slow_queries_in_quiet_sessions_are_logged_at_debug(database, caplog, monkeypatch):
+    monkeypatch.setattr(query_stats, 'slow_query_seconds', 0.0)
+    caplog.set_level(logging.DEBUG, logger=query_logger.name)
+    with quiet_sessions(), DbSession(database) as conn:
+        conn.fetch_column("SELECT value FROM rows")
+    slow = [record for record in caplog.records if record.getMessage().startswith('slow query')]
+    assert slow and all(record.levelno == logging.DEBUG for record in slow)
+    caplog.clear()
+    with DbSession(database) as conn:
+        conn.fetch_column("SELECT value FROM rows")
+    assert any(record.levelno == logging.WARNING and record.getMessage().startswith('slow query')
+               for record in caplog.records)